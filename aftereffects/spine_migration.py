@@ -8,22 +8,79 @@
 # 
 
 from __future__ import print_function
-import os, sys
+import os, sys, re
 import json
 import argparse
+import collections
+import fnmatch
+import hashlib
+import multiprocessing
+import shutil
+import tempfile
+import time
+
+try:
+	from os import scandir
+except ImportError:
+	scandir = None
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import orjson
+except ImportError:
+	orjson = None
 
 #
-# Initialize and parse command line arguments
+# Command line arguments, parsed when run as a script
 #
 p = argparse.ArgumentParser(
 	description='Migrate Spine json files to version 2.0.0 compatibility.')
 p.add_argument( "path", help="One or more files or directories", action="store", nargs="+")
 p.add_argument( "-r", "--recursive", help="If the path is a directory, recusively scan it for Spine data files.",
 	default=False, action="store_true")
+p.add_argument( "--include", help="Only migrate files matching this pattern. Can be given several times. Default: *.json",
+	default=None, action="append", metavar="PATTERN")
+p.add_argument( "--exclude", help="Skip files and directories matching this pattern. Can be given several times. "
+	".git, .svn and .hg are always skipped.", default=None, action="append", metavar="PATTERN")
+p.add_argument( "-j", "--jobs", help="Number of worker processes used to migrate files. 0 uses one per CPU.",
+	default=1, type=int, metavar="N")
+p.add_argument( "--cache", help="Manifest of already migrated files, used to skip unchanged files on later runs.",
+	default=".spine_migration_cache.json", metavar="FILE")
+p.add_argument( "--no-cache", help="Examine every file and don't read or write the cache.", default=False, action="store_true")
+p.add_argument( "--no-numpy", help="Don't use NumPy to rescale long scale timelines, even when it is installed.",
+	default=False, action="store_true")
+p.add_argument( "--format", help="How migrated files are written: indented (the default), compact, preserving "
+	"the original file's indentation, separators and key order, or compact with the faster orjson serializer.",
+	default="indent", choices=["indent", "compact", "preserve", "fast"])
+p.add_argument( "-n", "--dry-run", help="Migrate in memory only and write a json plan of the changes that would be made "
+	"instead of writing any files.", default=False, action="store_true")
+p.add_argument( "--plan", help="Write the --dry-run plan to this file instead of the standard output.",
+	default=None, metavar="FILE")
 p.add_argument( "-v", "--verbose", help="Copious output of all activity.", default=False, action="store_true")
 p.add_argument( "-q", "--quiet", help="Quiet mode.  Output nothing.", default=False, action="store_true")
 
-args = p.parse_args();
+args = None
+
+# Patterns are matched against both the name and the path of each entry
+DEFAULT_INCLUDES = [ "*.json" ]
+DEFAULT_EXCLUDES = [ ".git", ".svn", ".hg" ]
+
+# How much of each file is read to find the skeleton version before deciding
+# whether the whole file needs to be parsed
+HEADER_SIZE = 64 * 1024
+header_token = re.compile(r'"(?:[^"\\]|\\.)*"|"|[{}\[\]:,]')
+header_whitespace = re.compile(r'\s*')
+
+# Scale timelines with at least this many keys are rescaled with NumPy, when it
+# is installed.  Shorter timelines are faster in plain Python.
+NUMPY_MIN_KEYS = 256
+# Python 2 divides integers with integer division, which NumPy's float64
+# division doesn't match, so NumPy is then only used with float bone scales
+TRUE_DIVISION = sys.version_info[0] >= 3
 
 #
 # Functions
@@ -31,109 +88,509 @@ args = p.parse_args();
 def warning(*objs):
     print("WARNING: ", *objs, file=sys.stderr)
 
+def get_version(version_string):
+    return tuple(map(int, (version_string.split("."))))
+
+def format_version(version):
+    return ".".join(map(str, version)) if version is not None else None
+
+def replace_file(source, destination):
+    if hasattr(os, "replace"):
+        os.replace(source, destination)
+    else:
+        os.rename(source, destination)
+
+def init_worker(options):
+	# Worker processes don't inherit the parsed arguments on every platform
+	global args
+	args = options
+
+def matches(name, path, patterns):
+	for pattern in patterns:
+		if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(path, pattern):
+			return True
+	return False
+
+def list_directory(directory_name):
+	# os.scandir returns the entry types read with the directory listing, which
+	# saves a stat per entry
+	if scandir is not None:
+		for entry in scandir(directory_name):
+			yield entry.name, entry.path, entry.is_dir()
+	else:
+		for name in os.listdir(directory_name):
+			path = os.path.join(directory_name, name)
+			yield name, path, os.path.isdir(path)
+
 def scan_directory(directory_name):
-	if args.verbose:
-		print("Scanning:",directory_name)
-	names = os.listdir(directory_name)
-	if not directory_name.endswith("/"):
-		directory_name += "/"
-	for name in names:
-		name = directory_name + name
-		if os.path.isdir(name):
-			if args.recursive:
-				scan_directory(name)
-			else:
+	# Iterative walk.  Excluded directories are never listed.
+	includes = args.include or DEFAULT_INCLUDES
+	excludes = DEFAULT_EXCLUDES + (args.exclude or [])
+	# The cache is a json file too, and may be inside the scanned directory
+	cache_path = None if args.no_cache else os.path.abspath(args.cache)
+	pending = [ directory_name ]
+	while pending:
+		directory_name = pending.pop()
+		if args.verbose:
+			print("Scanning:",directory_name)
+		subdirectories = []
+		for name, path, is_directory in list_directory(directory_name):
+			if matches(name, path, excludes):
 				if args.verbose:
-					print("Skipping:",name)
+					print("Excluded:",path)
+			elif is_directory:
+				if args.recursive:
+					subdirectories.append(path)
+				else:
+					if args.verbose:
+						print("Skipping:",path)
+			elif matches(name, path, includes) and os.path.abspath(path) != cache_path:
+				yield path
+		# Keep the listing order of subdirectories
+		pending.extend(reversed(subdirectories))
+
+def scan_paths(paths):
+	for name in paths:
+		if not os.path.exists(name):
+			warning("File or directory",name,"not found.")
+			continue
+		if os.path.isdir(name):
+			for file_name in scan_directory(name):
+				yield file_name
 		else:
-			if name.endswith(".json"):
-				migrate_file(name)
+			yield name
 
-def migrate_file( name ):
-	if args.verbose:
-		print("Examining:",name)
-	change_count = 0
+def read_header( text ):
+	# Scan the top level keys at the start of a Spine json document without parsing
+	# the whole file.  Spine writes the "skeleton" object first, so the version is
+	# usually found within the first few tokens.
+	header = { "version": None, "bones": False, "slots": False, "complete": False }
+	decoder = json.JSONDecoder()
+	depth = 0
+	key = None
+	expect_key = False
+	match = header_token.search(text)
+	if match is None or match.group() != "{":
+		return header
+	while match is not None:
+		token = match.group()
+		position = match.end()
+		if token == '"':
+			# A string cut off by the end of the header
+			break
+		if token in "{[":
+			depth += 1
+			expect_key = depth == 1
+		elif token in "}]":
+			depth -= 1
+			if depth == 0:
+				header["complete"] = True
+				break
+		elif depth == 1:
+			if token == ",":
+				expect_key = True
+			elif token == ":":
+				expect_key = False
+				if key == "skeleton":
+					try:
+						skeleton, position = decoder.raw_decode(text, header_whitespace.match(text, position).end())
+					except ValueError:
+						break
+					try:
+						header["version"] = get_version(skeleton["spine"])
+					except (TypeError, KeyError, AttributeError, ValueError):
+						pass
+			elif expect_key:
+				key = json.loads(token)
+				if key in ("bones", "slots"):
+					header[key] = True
+		if header["version"] is not None:
+			break
+		match = header_token.search(text, position)
+	return header
+
+def needs_parsing( header ):
+	if header["version"] is not None:
+		return header["version"] < CURRENT_VERSION
+	if header["complete"]:
+		return header["bones"] and header["slots"]
+	# Not enough of the document was seen to decide
+	return True
+
+def migrate_file( name, known_hash=None ):
+	# Runs in a worker process when --jobs is used, so nothing is printed here.
+	# The result is reported by the main process.
+	result = { "path": name, "changes": 0, "warnings": [], "parsed": False, "cached": False, "steps": {} }
 	# Open file and see if any migrations need be applied
-	with open(name) as file:
-		try:
-			spine_data = json.load(file)
-		except ValueError as e:
-			warning("Error reading json from file",name)
-			spine_data = None
-		if spine_data is not None and "bones" in spine_data and "slots" in spine_data:
-			change_count += migrate( spine_data )
+	with open(name, "rb") as file:
+		if args.no_cache:
+			data = file.read(HEADER_SIZE)
+		else:
+			# The whole file is needed for the content hash
+			data = file.read()
+			set_file_state(result, data, os.fstat(file.fileno()))
+			if result["hash"] == known_hash:
+				result["cached"] = True
+				return result
+		header = read_header(data[:HEADER_SIZE].decode("utf-8-sig", "replace"))
+		result["version"] = format_version(header["version"])
+		if not needs_parsing(header):
+			return result
+		if args.no_cache:
+			data += file.read()
+	result["parsed"] = True
+	try:
+		text = data.decode("utf-8-sig")
+		if args.format == "preserve":
+			spine_data = json.loads(text, object_pairs_hook=collections.OrderedDict)
+		else:
+			spine_data = json.loads(text)
+	except ValueError as e:
+		result["warnings"].append("Error reading json from file " + name)
+		spine_data = None
+	if spine_data is not None and "bones" in spine_data and "slots" in spine_data:
+		result["original_version"] = spine_data["skeleton"].get("spine") if "skeleton" in spine_data else None
+		result["plan"] = [] if args.dry_run else None
+		result["changes"] += migrate( spine_data, result["steps"], result["plan"] )
+		if "skeleton" in spine_data:
+			result["version"] = spine_data["skeleton"].get("spine")
 	# If any changes were made, overwrite the file
-	if change_count > 0:
-		with open(name,"w") as file:
-			json.dump(spine_data,file,indent=1)
+	if result["changes"] > 0 and not args.dry_run:
+		data = dump_json(spine_data, text)
+		write_file(name, data)
+		if not args.no_cache:
+			set_file_state(result, data, os.stat(name))
+	return result
+
+def dump_json( spine_data, original_text ):
+	if args.format == "fast":
+		return orjson.dumps(spine_data)
+	if args.format == "compact":
+		text = json.dumps(spine_data, separators=(",", ":"))
+	elif args.format == "preserve":
+		text = json.dumps(spine_data, **detect_format(original_text))
+		if original_text.endswith("\n"):
+			text += "\n"
+	else:
+		text = json.dumps(spine_data, indent=1)
+	return text.encode("utf-8")
+
+def detect_format( text ):
+	# Find the json.dumps arguments closest to how the original file was written
+	key_separator = ": " if re.search(r'"\s*: ', text) else ":"
+	lines = text.splitlines()
+	if len(lines) < 2:
+		item_separator = ", " if re.search(r'[\]}"\deElnu], ', text) else ","
+		return { "separators": (item_separator, key_separator) }
+	indent = len(lines[1]) - len(lines[1].lstrip())
+	if lines[1].startswith("\t") and sys.version_info[0] >= 3:
+		indent = "\t" * indent
+	return { "indent": indent, "separators": (",", key_separator) }
+
+def write_file( name, data ):
+	# Write next to the destination and rename it over the old file, so an
+	# interrupted run never leaves a partially written file behind
+	directory_name = os.path.dirname(os.path.abspath(name))
+	handle, temp_name = tempfile.mkstemp(prefix=".spine_migration", dir=directory_name)
+	try:
+		with os.fdopen(handle, "wb") as file:
+			file.write(data)
+		if os.path.exists(name):
+			shutil.copymode(name, temp_name)
+		else:
+			# mkstemp creates files only the owner can read
+			umask = os.umask(0)
+			os.umask(umask)
+			os.chmod(temp_name, 0o666 & ~umask)
+		replace_file(temp_name, name)
+	except:
+		os.remove(temp_name)
+		raise
+
+def migrate_job( job ):
+	return migrate_file(*job)
+
+def set_file_state( result, data, stat ):
+	result["hash"] = hashlib.sha1(data).hexdigest()
+	result["mtime"] = stat.st_mtime
+	result["size"] = stat.st_size
+
+#
+# Cache of files examined by earlier runs.  Files whose mtime and size match the
+# cache are skipped after a single stat.  Files that were touched but still have
+# the same content are skipped after hashing, without parsing them.
+#
+def load_cache( cache_name ):
+	cache = {}
+	try:
+		with open(cache_name) as file:
+			contents = json.load(file)
+		# Files are examined again whenever the migration target changes
+		if contents.get("target") == format_version(CURRENT_VERSION):
+			cache = contents["files"]
+	except (IOError, OSError, ValueError, KeyError, AttributeError):
+		pass
+	return cache
+
+def save_cache( cache_name, cache ):
+	# Forget files that have been deleted or moved since they were cached
+	for path in [ path for path in cache if not os.path.exists(path) ]:
+		del cache[path]
+	contents = { "target": format_version(CURRENT_VERSION), "files": cache }
+	write_file(cache_name, json.dumps(contents, indent=1, sort_keys=True).encode("utf-8"))
+
+def cached_job( cache, name ):
+	# Returns a result for a file that is unchanged since the last run,
+	# otherwise the job that examines it
+	entry = cache.get(os.path.abspath(name))
+	if entry is None:
+		return None, (name, None)
+	try:
+		stat = os.stat(name)
+	except OSError:
+		return None, (name, None)
+	if stat.st_mtime == entry["mtime"] and stat.st_size == entry["size"]:
+		return { "path": name, "changes": 0, "warnings": [], "parsed": False, "cached": True, "steps": {} }, None
+	return None, (name, entry["hash"])
+
+def update_cache( cache, result ):
+	key = os.path.abspath(result["path"])
+	if result["cached"]:
+		# Touched but unchanged files get their new mtime so the next run only needs a stat
+		if "mtime" in result:
+			cache[key]["mtime"] = result["mtime"]
+	elif result["warnings"] or "hash" not in result:
+		cache.pop(key, None)
+	else:
+		cache[key] = { "mtime": result["mtime"], "size": result["size"], "hash": result["hash"],
+			"version": result["version"] }
+
+def report_result( result, summary ):
+	name = result["path"]
+	if args.verbose:
+		print("Examining:",name)
+	for message in result["warnings"]:
+		warning(message)
+	if result["changes"] > 0:
 		if not args.quiet:
-			print("Migrated:",name)
+			print("Would migrate:" if args.dry_run else "Migrated:",name)
+		summary["migrated"] += 1
 	else:
 		if args.verbose:
 			print("No changes:",name)
+	summary["files"] += 1
+	if result["cached"]:
+		summary["cached"] += 1
+	else:
+		summary["parsed" if result["parsed"] else "skipped"] += 1
+	summary["changes"] += result["changes"]
+	summary["warnings"] += len(result["warnings"])
+	for step_name in sorted(result["steps"]):
+		step_stats = result["steps"][step_name]
+		if args.verbose:
+			print("  Step %s: %d changes, %.3f ms" % (step_name, step_stats["changes"], step_stats["seconds"] * 1000))
+		total = summary["steps"].setdefault(step_name, { "files": 0, "changes": 0, "seconds": 0.0 })
+		total["files"] += 1
+		total["changes"] += step_stats["changes"]
+		total["seconds"] += step_stats["seconds"]
 
-	return change_count
+def migrate_paths( paths ):
+	summary = { "files": 0, "cached": 0, "skipped": 0, "parsed": 0, "migrated": 0, "changes": 0, "warnings": 0,
+		"steps": {} }
+	cache = None if args.no_cache else load_cache(args.cache)
+	plan = []
+	def finish( result ):
+		report_result(result, summary)
+		if cache is not None:
+			update_cache(cache, result)
+		if args.dry_run and result["changes"] > 0:
+			plan.append({ "path": result["path"], "from": result["original_version"], "to": result["version"],
+				"changes": result["changes"], "timelines": result["plan"] })
+	def cached_or_job( name ):
+		if cache is None:
+			return None, (name, None)
+		return cached_job(cache, name)
+	jobs = args.jobs if args.jobs > 0 else multiprocessing.cpu_count()
+	if jobs == 1:
+		for name in scan_paths(paths):
+			result, job = cached_or_job(name)
+			finish(result if result is not None else migrate_job(job))
+	else:
+		cached_results = []
+		def pending_jobs():
+			for name in scan_paths(paths):
+				result, job = cached_or_job(name)
+				if result is None:
+					yield job
+				else:
+					cached_results.append(result)
+		pool = multiprocessing.Pool(jobs, init_worker, (args,))
+		try:
+			results = list(pool.imap_unordered(migrate_job, pending_jobs(), 16))
+		finally:
+			pool.close()
+			pool.join()
+		# Workers finish in any order, report them ordered by path so runs are comparable
+		for result in sorted(results + cached_results, key=lambda result: result["path"]):
+			finish(result)
+	if args.dry_run:
+		write_plan(plan, summary)
+	elif cache is not None:
+		save_cache(args.cache, cache)
+	if not args.quiet:
+		print("Summary: %d files examined, %d unchanged since the last run, %d skipped, %d parsed, %d migrated, %d changes, %d warnings" %
+			(summary["files"], summary["cached"], summary["skipped"], summary["parsed"], summary["migrated"],
+			summary["changes"], summary["warnings"]))
+		for step_name in sorted(summary["steps"], key=get_version):
+			step_stats = summary["steps"][step_name]
+			print("Step %s: %d files, %d changes, %.3f s" %
+				(step_name, step_stats["files"], step_stats["changes"], step_stats["seconds"]))
+	return summary
 
-def migrate( spine_data ):
-	version = get_version( spine_data["skeleton"]["spine"] ) if "skeleton" in spine_data else (1,0,0)
-	change_count = 0
-	if version < (2,0,0):
-		change_count += migrate_2_0_0( spine_data )
-	return change_count
+def write_plan( plan, summary ):
+	plan.sort(key=lambda entry: entry["path"])
+	contents = json.dumps({ "files": plan, "summary": summary }, indent=1, sort_keys=True)
+	if args.plan is None:
+		print(contents)
+	else:
+		write_file(args.plan, contents.encode("utf-8"))
 
-def migrate_2_0_0( spine_data ):
-	change_count = 0
-	for animation_name in spine_data["animations"]:
+def migrate( spine_data, stats=None, plan=None ):
+	# Applies every registered step newer than the document's version.  The
+	# animations are walked once and each bone timeline is handed to every step
+	# that handles it, in version order.  Steps describe their changes in the
+	# plan list when one is given.
+	version = get_version( spine_data["skeleton"]["spine"] ) if "skeleton" in spine_data else (1,0,0)
+	steps = [ MIGRATIONS[key] for key in sorted(MIGRATIONS, key=lambda key: key[1]) if version < key[1] ]
+	if not steps:
+		return 0
+	if stats is None:
+		stats = {}
+	for step in steps:
+		stats[step["name"]] = { "changes": 0, "seconds": 0.0 }
+	context = { "spine_data": spine_data, "index": build_index( spine_data ), "plan": plan }
+	for animation_name in spine_data.get("animations", {}):
+		context["animation"] = animation_name
 		animation_data = spine_data["animations"][animation_name]
 		if "bones" in animation_data:
 			for bone_name in animation_data["bones"]:
-				bone_animation_data = spine_data["animations"][animation_name]["bones"][bone_name]
-				if "scale" in bone_animation_data:
-					bone_data = filter( lambda x: x["name"] == bone_name, spine_data["bones"])[0]
-					# Get the bone's scale and don't let it get below 0.001
-					bone_scale_x = bone_data["scaleX"] if "scaleX" in bone_data else 1.0
-					bone_scale_y = bone_data["scaleY"] if "scaleY" in bone_data else 1.0
-					if bone_scale_x != 1.0 or bone_scale_y != 1.0:
-						change_count = change_count + 1
-						# Replace the values on the timeline with the final scale values first
-						for scale_keyframe in bone_animation_data["scale"]:
-							scale_keyframe["x"] = scale_keyframe["x"] + bone_scale_x - 1
-							scale_keyframe["y"] = scale_keyframe["y"] + bone_scale_y - 1
-						# Don't let the bone go below scale 0.001
-						if bone_scale_x < 0.001 and bone_scale_x > -0.001:
-							if bone_scale_x < 0.0:
-								bone_scale_x = 0.001
-							else:
-								bone_scale_x = -0.001
-							bone_data["scaleX"] = bone_scale_x
-						if bone_scale_y < 0.001 and bone_scale_y > -0.001:
-							if bone_scale_y < 0.0:
-								bone_scale_y = 0.001
-							else:
-								bone_scale_y = -0.001
-							bone_data["scaleY"] = bone_scale_y
-						# Replace the values on the timeline with values relative to the bone scale
-						for scale_keyframe in bone_animation_data["scale"]:
-							scale_keyframe["x"] = scale_keyframe["x"] / bone_scale_x
-							scale_keyframe["y"] = scale_keyframe["y"] / bone_scale_y
+				bone_animation_data = animation_data["bones"][bone_name]
+				bone_data = context["index"]["bones"].get(bone_name)
+				# Timelines for bones that don't exist are ignored by Spine
+				if bone_data is None:
+					continue
+				for timeline_name in bone_animation_data:
+					for step in steps:
+						if timeline_name in step["bone_timelines"]:
+							context["step"] = step["name"]
+							start = time.time()
+							stats[step["name"]]["changes"] += step["bone_timelines"][timeline_name](
+								context, bone_name, bone_data, bone_animation_data[timeline_name])
+							stats[step["name"]]["seconds"] += time.time() - start
+	change_count = sum(stats[step["name"]]["changes"] for step in steps)
 	if change_count > 0:
+		target = steps[-1]["name"]
 		if "skeleton" in spine_data:
-			spine_data["skeleton"]["spine"] = "2.0.0"
+			spine_data["skeleton"]["spine"] = target
 		else:
-			spine_data["skeleton"] = { "spine": "2.0.0", "width": 0, "height": 0, "hash":"" }
+			spine_data["skeleton"] = { "spine": target, "width": 0, "height": 0, "hash":"" }
 	return change_count
 
-def get_version(version_string):
-    return tuple(map(int, (version_string.split("."))))
+def build_index( spine_data ):
+	# Bone, slot and skin entries by name.  Built once per document and shared by
+	# all migration steps.  The first entry wins if a name is repeated.
+	index = { "bones": {}, "slots": {}, "skins": {} }
+	for bone in spine_data.get("bones", []):
+		index["bones"].setdefault(bone["name"], bone)
+	for slot in spine_data.get("slots", []):
+		index["slots"].setdefault(slot["name"], slot)
+	skins = spine_data.get("skins", {})
+	if isinstance(skins, dict):
+		# Before Spine 3.8 skins are a map of skin name to slot attachments
+		index["skins"].update(skins)
+	else:
+		for skin in skins:
+			index["skins"].setdefault(skin["name"], skin)
+	return index
 
 #
-# Scan all directories and files provided
+# Migration steps
 #
-for name in args.path:
-	if not os.path.exists(name):
-		warning("File or directory",name,"not found.")
-		continue
-	if os.path.isdir(name):
-		scan_directory(name)
+def migrate_2_0_0_scale( context, bone_name, bone_data, scale_timeline ):
+	# Get the bone's scale and don't let it get below 0.001
+	bone_scale_x = bone_data["scaleX"] if "scaleX" in bone_data else 1.0
+	bone_scale_y = bone_data["scaleY"] if "scaleY" in bone_data else 1.0
+	if bone_scale_x == 1.0 and bone_scale_y == 1.0:
+		return 0
+	original_scale_x = bone_scale_x
+	original_scale_y = bone_scale_y
+	# Don't let the bone go below scale 0.001
+	if bone_scale_x < 0.001 and bone_scale_x > -0.001:
+		if bone_scale_x < 0.0:
+			bone_scale_x = 0.001
+		else:
+			bone_scale_x = -0.001
+		bone_data["scaleX"] = bone_scale_x
+	if bone_scale_y < 0.001 and bone_scale_y > -0.001:
+		if bone_scale_y < 0.0:
+			bone_scale_y = 0.001
+		else:
+			bone_scale_y = -0.001
+		bone_data["scaleY"] = bone_scale_y
+	if context["plan"] is not None:
+		context["plan"].append({ "step": context["step"], "animation": context["animation"], "bone": bone_name,
+			"timeline": "scale", "keys": len(scale_timeline), "boneScale": [ original_scale_x, original_scale_y ],
+			"newBoneScale": [ bone_scale_x, bone_scale_y ] })
+	# Replace the values on the timeline with the final scale values, then make
+	# them relative to the bone scale
+	if use_numpy(scale_timeline, bone_scale_x, bone_scale_y):
+		rescale_keys_numpy(scale_timeline, "x", original_scale_x, bone_scale_x)
+		rescale_keys_numpy(scale_timeline, "y", original_scale_y, bone_scale_y)
 	else:
-		migrate_file(name)
\ No newline at end of file
+		for scale_keyframe in scale_timeline:
+			scale_keyframe["x"] = (scale_keyframe["x"] + original_scale_x - 1) / bone_scale_x
+			scale_keyframe["y"] = (scale_keyframe["y"] + original_scale_y - 1) / bone_scale_y
+	return 1
+
+def use_numpy( timeline, *divisors ):
+	if numpy is None or (args is not None and args.no_numpy) or len(timeline) < NUMPY_MIN_KEYS:
+		return False
+	# A float divisor makes the plain Python division a float division too
+	return TRUE_DIVISION or all(isinstance(divisor, float) for divisor in divisors)
+
+def rescale_keys_numpy( timeline, axis, offset, divisor ):
+	# The same operations in the same order as the plain Python loop, on float64
+	# values, so the results are identical
+	values = numpy.fromiter((keyframe[axis] for keyframe in timeline), dtype=numpy.float64, count=len(timeline))
+	values = (values + offset - 1) / divisor
+	for keyframe, value in zip(timeline, values.tolist()):
+		keyframe[axis] = value
+
+#
+# Registry of migration steps, keyed by the (source, target) versions they
+# migrate between.  "bone_timelines" maps a bone timeline name to a function
+# called with the migration context, bone name, bone data and the timeline's
+# keys.  It returns the number of changes made.
+#
+MIGRATIONS = {}
+
+def register_migration( source, target, bone_timelines ):
+	MIGRATIONS[(source, target)] = { "name": format_version(target), "source": source, "target": target,
+		"bone_timelines": bone_timelines }
+
+register_migration( (1,0,0), (2,0,0), { "scale": migrate_2_0_0_scale } )
+
+# The newest Spine data version this script migrates to
+CURRENT_VERSION = max(target for source, target in MIGRATIONS)
+
+#
+# Scan all directories and files provided
+#
+if __name__ == "__main__":
+	args = p.parse_args()
+	if args.dry_run and args.plan is None:
+		# The plan is written to the standard output
+		args.quiet = True
+	if args.format == "fast" and orjson is None:
+		p.error("--format fast requires the orjson package")
+	migrate_paths(args.path)
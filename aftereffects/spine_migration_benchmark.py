@@ -0,0 +1,169 @@
+#!/bin/python
+#
+# spine_migration_benchmark.py
+#
+# Measures spine_migration.py throughput on generated Spine json documents.
+# Each document is timed end-to-end through migrate_file and by phase: parse,
+# migrate (including the time spent in each migration step) and serialize.
+# The results are written as a json report so runs can be compared over time.
+#
+
+from __future__ import print_function
+import os, sys
+import json
+import argparse
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import spine_migration
+
+#
+# Command line arguments
+#
+p = argparse.ArgumentParser(
+	description='Benchmark spine_migration.py on generated Spine json files.')
+p.add_argument( "--bones", help="Bones per skeleton.", default=100, type=int)
+p.add_argument( "--slots", help="Slots per skeleton.", default=100, type=int)
+p.add_argument( "--animations", help="Animations per skeleton.", default=20, type=int)
+p.add_argument( "--keys", help="Keys per scale timeline.", default=100, type=int)
+p.add_argument( "--files", help="Number of files migrated for the end-to-end timing.", default=10, type=int)
+p.add_argument( "--repeat", help="Number of times each measurement is repeated. The fastest run is reported.",
+	default=5, type=int)
+p.add_argument( "--seed", help="Random seed for the generated documents.", default=0, type=int)
+p.add_argument( "--format", help="Output format passed to spine_migration.py.", default="indent",
+	choices=["indent", "compact", "preserve", "fast"])
+p.add_argument( "--no-numpy", help="Don't use NumPy in spine_migration.py.", default=False, action="store_true")
+p.add_argument( "-o", "--output", help="Write the report to this file instead of the standard output.", default=None)
+
+#
+# Functions
+#
+def generate_skeleton(bone_count, slot_count, animation_count, key_count, rng):
+	# A skeleton older than 2.0.0 where every bone has a setup pose scale and a
+	# scale timeline in every animation, so every timeline is migrated
+	bones = [ { "name": "root" } ]
+	for i in range(1, bone_count):
+		bones.append({
+			"name": "bone%d" % i,
+			"parent": bones[rng.randrange(i)]["name"],
+			"length": rng.uniform(10, 100),
+			"x": rng.uniform(-100, 100),
+			"y": rng.uniform(-100, 100),
+			"rotation": rng.uniform(-180, 180),
+			"scaleX": rng.uniform(0.5, 2),
+			"scaleY": rng.uniform(0.5, 2),
+		})
+	slots = []
+	for i in range(slot_count):
+		slots.append({ "name": "slot%d" % i, "bone": bones[i % bone_count]["name"], "attachment": "image%d" % i })
+	attachments = {}
+	for slot in slots:
+		attachments[slot["name"]] = { slot["attachment"]: { "x": rng.uniform(-50, 50), "y": rng.uniform(-50, 50),
+			"width": 64, "height": 64 } }
+	animations = {}
+	for i in range(animation_count):
+		timelines = {}
+		for bone in bones:
+			timelines[bone["name"]] = {
+				"rotate": [ { "time": k / 30.0, "angle": rng.uniform(-180, 180) } for k in range(key_count) ],
+				"scale": [ { "time": k / 30.0, "x": rng.uniform(0.5, 2), "y": rng.uniform(0.5, 2) }
+					for k in range(key_count) ],
+			}
+		animations["animation%d" % i] = { "bones": timelines }
+	return {
+		"skeleton": { "hash": "", "spine": "1.9.0", "width": 0, "height": 0 },
+		"bones": bones,
+		"slots": slots,
+		"skins": { "default": attachments },
+		"animations": animations,
+	}
+
+def best(timings):
+	return min(timings)
+
+def benchmark_phases(text, repeat):
+	# Time each phase of migrate_file separately, on a fresh parse every run
+	timings = { "parse": [], "migrate": [], "serialize": [] }
+	steps = {}
+	for i in range(repeat):
+		start = time.time()
+		spine_data = json.loads(text)
+		timings["parse"].append(time.time() - start)
+		stats = {}
+		start = time.time()
+		spine_migration.migrate(spine_data, stats)
+		timings["migrate"].append(time.time() - start)
+		for step_name in stats:
+			steps.setdefault(step_name, []).append(stats[step_name]["seconds"])
+		start = time.time()
+		spine_migration.dump_json(spine_data, text)
+		timings["serialize"].append(time.time() - start)
+	report = dict((phase, best(timings[phase])) for phase in timings)
+	report["steps"] = dict((step_name, best(steps[step_name])) for step_name in steps)
+	return report
+
+def benchmark_files(text, file_count, repeat):
+	# Time migrate_file end-to-end, including reading and writing the files
+	directory_name = tempfile.mkdtemp(prefix="spine_migration_benchmark")
+	try:
+		timings = []
+		for i in range(repeat):
+			names = []
+			for n in range(file_count):
+				name = os.path.join(directory_name, "skeleton%d.json" % n)
+				with open(name, "w") as file:
+					file.write(text)
+				names.append(name)
+			start = time.time()
+			for name in names:
+				spine_migration.migrate_file(name)
+			timings.append(time.time() - start)
+	finally:
+		shutil.rmtree(directory_name)
+	return { "seconds": best(timings), "files_per_second": file_count / best(timings) if best(timings) > 0 else None }
+
+#
+# Generate the skeleton and run the benchmarks
+#
+if __name__ == "__main__":
+	args = p.parse_args()
+	if args.format == "fast" and spine_migration.orjson is None:
+		p.error("--format fast requires the orjson package")
+	migration_args = [ "--no-cache", "--quiet", "--format", args.format ]
+	if args.no_numpy:
+		migration_args.append("--no-numpy")
+	spine_migration.args = spine_migration.p.parse_args(migration_args + [ "unused" ])
+
+	spine_data = generate_skeleton(args.bones, args.slots, args.animations, args.keys, random.Random(args.seed))
+	text = json.dumps(spine_data, indent=1)
+	report = {
+		"config": {
+			"bones": args.bones,
+			"slots": args.slots,
+			"animations": args.animations,
+			"keys": args.keys,
+			"files": args.files,
+			"repeat": args.repeat,
+			"seed": args.seed,
+			"format": args.format,
+		},
+		"environment": {
+			"python": platform.python_version(),
+			"implementation": platform.python_implementation(),
+			"platform": platform.platform(),
+			"numpy": spine_migration.numpy is not None and not args.no_numpy and args.keys >= spine_migration.NUMPY_MIN_KEYS,
+		},
+		"document_bytes": len(text),
+		"phases": benchmark_phases(text, args.repeat),
+		"end_to_end": benchmark_files(text, args.files, args.repeat),
+	}
+	contents = json.dumps(report, indent=1, sort_keys=True)
+	if args.output is None:
+		print(contents)
+	else:
+		with open(args.output, "w") as file:
+			file.write(contents + "\n")
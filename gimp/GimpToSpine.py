@@ -8,18 +8,52 @@ Where *install* is the GIMP installation folder and *version* is the GIMP versio
 
 To run, in GIMP choose: File -> Export to Spine
 
+To export directories of .xcf files with GIMP's batch mode, run:
+python GimpToSpine.py batch [options] inputs...
+
 Original hosting location:
 https://github.com/clofresh/gimp-spine
 '''
 
+import argparse
+import binascii
+import hashlib
 import json
 import math
+import multiprocessing
 import os.path
+import shutil
+import subprocess
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from multiprocessing.pool import ThreadPool
+
+try:
+    import gimpfu
+    from gimp import pdb
+except ImportError:
+    # Run outside of GIMP, as the batch command line
+    gimpfu = None
+    pdb = None
+
+ATLAS_MAX_SIZES = [512, 1024, 2048, 4096, 8192]
 
-import gimpfu
-from gimp import pdb
+# The atlas is written to this subdirectory, so its pages can't overwrite a
+# layer image with the same name
+ATLAS_DIR = 'atlas'
 
-def spine_export(img, active_layer, compression, dir_name, crop_layers):
+# PNG color types by bytes per pixel, for gray, gray alpha, RGB and RGBA
+PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+# The gamma written to the PNG files, 1/2.2 as written by GIMP
+PNG_GAMMA = 45455
+
+def spine_export(img, active_layer, compression, dir_name, crop_layers,
+                 pack_atlas=False, atlas_size=2, atlas_padding=2, jobs=0,
+                 dedup_images=False, report_layers=False):
     ''' Plugin entry point
     '''
 
@@ -32,6 +66,16 @@ def spine_export(img, active_layer, compression, dir_name, crop_layers):
     }
     slots = output['slots']
     attachments = output['skins']['default']
+    name = os.path.splitext(os.path.basename(img.filename))[0]
+    regions = AtlasRegions()
+    writer = PngWriter(int(compression), int(jobs), report_layers, img.resolution)
+    # The first layer name saved for each pixel hash, when sharing identical images
+    shared = {} if dedup_images else None
+    start = time.time()
+
+    # All the layers are saved from one scratch image, resized to each layer
+    scratch_img = pdb.gimp_image_new(1, 1, img.base_type)
+    pdb.gimp_image_undo_disable(scratch_img)
 
     # Iterate through the layers, extracting their info into the JSON output
     # and saving the layers as individual images
@@ -40,37 +84,39 @@ def spine_export(img, active_layer, compression, dir_name, crop_layers):
             continue
 
         if layer.visible:
-            if crop_layers:
-                img.active_layer = layer
-                width = layer.width
-                height = layer.height
-                x, y = layer.offsets
-                pdb.plug_in_autocrop_layer(img, layer)
+            to_save = process_layer(img, layer, slots, attachments, crop_layers)
+            to_save = save_layers(scratch_img, writer, to_save, compression, dir_name,
+                                  attachments, shared)
+            if pack_atlas:
+                for saved, crop in to_save:
+                    regions.add(saved, crop, crop if crop_layers else None)
 
-            to_save = process_layer(img, layer, slots, attachments)
-            save_layers(img, to_save, compression, dir_name)
-
-            if crop_layers:
-                img.active_layer = layer
-                x_new, y_new = layer.offsets
-                layer.resize(width, height, - x + x_new, - y + y_new)
+    pdb.gimp_image_delete(scratch_img)
+    saved_bytes = writer.close()
+    pdb.gimp_message('Spine export: saved %d images, %d bytes in %.3f s' % (
+        writer.saved_files, saved_bytes, time.time() - start))
 
+    if pack_atlas:
+        save_atlas(regions, compression, os.path.join(dir_name, ATLAS_DIR), name,
+                   ATLAS_MAX_SIZES[int(atlas_size)], int(atlas_padding))
 
     # Write the JSON output
-    name = os.path.splitext(os.path.basename(img.filename))[0]
     with open(os.path.join(dir_name, '%s.json' % name), 'w') as json_file:
         json.dump(output, json_file)
 
-def process_layer(img, layer, slots, attachments):
+def process_layer(img, layer, slots, attachments, crop_layers=False):
     ''' Extracts the Spine info from each layer, recursing as necessary on
-        layer groups. Returns all the layers it processed in a flat list.
+        layer groups. Returns all the layers it processed in a flat list of
+        (layer, crop) pairs, where crop is the exported part of the layer
+        as (x, y, width, height) relative to the layer. With `crop_layers`,
+        that is the non-transparent part of the layer.
     '''
     processed = []
 
     # If this layer is a layer has sublayers, recurse into them
     if hasattr(layer, 'layers'):
         for sublayer in layer.layers:
-            processed.extend(process_layer(img, sublayer, slots, attachments))
+            processed.extend(process_layer(img, sublayer, slots, attachments, crop_layers))
     else:
         layer_name = layer.name
 
@@ -79,11 +125,15 @@ def process_layer(img, layer, slots, attachments):
             'bone': 'root',
             'attachment': layer_name,
         })
+        crop = (alpha_bounds(layer) if crop_layers else None) or (0, 0, layer.width, layer.height)
+        left, top, width, height = crop
         x, y = layer.offsets
+        x += left
+        y += top
 
         # Compensate for GIMP using the top left as the origin, vs Spine using the center.
-        x += math.floor(layer.width / 2)
-        y += math.floor(layer.height / 2)
+        x += math.floor(width / 2)
+        y += math.floor(height / 2)
 
         # Center the image on Spine's x origin,
         x -= math.floor(img.width / 2)
@@ -95,29 +145,55 @@ def process_layer(img, layer, slots, attachments):
             'x': x,
             'y': y,
             'rotation': 0,
-            'width': layer.width,
-            'height': layer.height,
+            'width': width,
+            'height': height,
         }}
-        processed.append(layer)
+        processed.append((layer, crop))
 
     return processed
 
-def save_layers(img, layers, compression, dir_name):
-    ''' Takes a list of layers and saves them in `dir_name` as PNGs,
-        naming the files after their layer names.
+def save_layers(scratch_img, writer, layers, compression, dir_name,
+                attachments=None, shared=None):
+    ''' Takes a list of (layer, crop) pairs and saves the cropped layers in
+        `dir_name` as PNGs, naming the files after their layer names. The
+        pixels of each crop are read and handed to `writer`, which encodes
+        them in the background. Indexed layers are copied into
+        `scratch_img`, cropped, and saved by GIMP with their palette.
+
+        With a `shared` dict, a layer with the same pixels as a layer saved
+        before is not saved, and its attachment gets the image of that
+        layer as its path. Returns the (layer, crop) pairs that were saved.
     '''
 
-    for layer in layers:
-        tmp_img = pdb.gimp_image_new(img.width, img.height, img.base_type)
-        tmp_layer = pdb.gimp_layer_new_from_drawable(layer, tmp_img)
-        tmp_layer.name = layer.name
-        tmp_img.add_layer(tmp_layer, 0)
+    saved = []
+    for layer, crop in layers:
+        left, top, width, height = crop
         filename = '%s.png' % layer.name
         fullpath = os.path.join(dir_name, filename)
-        tmp_img.resize_to_layers()
+        if not layer.is_indexed:
+            region = layer.get_pixel_rgn(left, top, width, height, False, False)
+            if region.bpp in PNG_COLOR_TYPES:
+                pixels = region[left:left + width, top:top + height]
+                if shared is not None:
+                    key = hashlib.sha1('%d %d %d ' % (width, height, region.bpp) + pixels).hexdigest()
+                    original = shared.setdefault(key, layer.name)
+                    if original != layer.name:
+                        attachments[layer.name][layer.name]['path'] = original
+                        continue
+                writer.save(fullpath, width, height, region.bpp, pixels)
+                saved.append((layer, crop))
+                continue
+
+        start = time.time()
+        pdb.gimp_image_resize(scratch_img, width, height, 0, 0)
+        tmp_layer = pdb.gimp_layer_new_from_drawable(layer, scratch_img)
+        tmp_layer.name = layer.name
+        scratch_img.add_layer(tmp_layer, 0)
+        tmp_layer.resize(width, height, -left, -top)
+        tmp_layer.set_offsets(0, 0)
         pdb.file_png_save(
-            tmp_img,
-            tmp_img.layers[0],
+            scratch_img,
+            tmp_layer,
             fullpath,
             filename,
             0, # interlace
@@ -128,34 +204,586 @@ def save_layers(img, layers, compression, dir_name):
             1, # phys
             1 # time
         )
+        scratch_img.remove_layer(tmp_layer)
+        writer.saved(fullpath, time.time() - start)
+        saved.append((layer, crop))
+    return saved
+
+def filter_rows(pixels, width, height, bpp):
+    ''' Returns the PNG image data of the pixels, each row prefixed with
+        its filter type. Each row uses the filter, none, Sub or Up, whose
+        output has the most zero bytes, which compresses best for the
+        smooth gradients and flat areas of most layers.
+    '''
+    stride = width * bpp
+    length = len(pixels)
+    if not length:
+        return pixels
+
+    # Sub subtracts the pixel to the left, Up the pixel above. The pixels are
+    # converted to a big integer, so the bytes are subtracted at C speed, and
+    # shifting it gives the left and above pixels. The high bit of each byte
+    # is set in the minuend and cleared in the subtrahend, so no borrow
+    # crosses into the next byte, and the high bit of the result is then
+    # fixed.
+    value = int(binascii.hexlify(pixels), 16)
+    high = ((1 << 8 * length) - 1) // 255 * 0x80
+    low = high - (high >> 7)
+
+    def subtract(prior):
+        difference = ((value | high) - (prior & low)) ^ ((value ^ prior ^ high) & high)
+        return binascii.unhexlify(('%x' % difference).zfill(2 * length))
+
+    sub = subtract(value >> 8 * bpp)
+    up = subtract(value >> 8 * stride)
+
+    rows = []
+    for y in range(height):
+        start = y * stride
+        raw = pixels[start:start + stride]
+        candidates = [
+            (b'\x00', raw),
+            # The first pixel of a row has nothing to its left
+            (b'\x01', raw[:bpp] + sub[start + bpp:start + stride]),
+            (b'\x02', up[start:start + stride]),
+        ]
+        best = None
+        best_zeros = -1
+        for candidate in candidates:
+            zeros = candidate[1].count(b'\x00')
+            if zeros > best_zeros:
+                best, best_zeros = candidate, zeros
+        rows.append(best[0] + best[1])
+    return b''.join(rows)
+
+def write_png(fullpath, width, height, bpp, pixels, compression, resolution=None):
+    ''' Encodes 8 bit gray, gray alpha, RGB or RGBA pixels, given as a
+        string of rows, to a PNG file with the gamma, the resolution in
+        pixels per inch if given, and the time. Returns the number of bytes
+        written and the time spent.
+    '''
+    start = time.time()
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data +
+                struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+
+    header = struct.pack('>IIBBBBB', width, height, 8, PNG_COLOR_TYPES[bpp], 0, 0, 0)
+    chunks = [chunk(b'IHDR', header), chunk(b'gAMA', struct.pack('>I', PNG_GAMMA))]
+    if resolution:
+        # The resolution is stored in pixels per meter
+        chunks.append(chunk(b'pHYs', struct.pack(
+            '>IIB', int(round(resolution[0] / 0.0254)), int(round(resolution[1] / 0.0254)), 1)))
+    chunks.append(chunk(b'tIME', struct.pack('>HBBBBB', *time.gmtime()[:6])))
+    rows = filter_rows(pixels, width, height, bpp)
+    chunks += [chunk(b'IDAT', zlib.compress(rows, compression)), chunk(b'IEND', b'')]
+
+    data = b'\x89PNG\r\n\x1a\n' + b''.join(chunks)
+    with open(fullpath, 'wb') as png_file:
+        png_file.write(data)
+    return len(data), time.time() - start
+
+class PngWriter(object):
+    ''' Writes PNG files on a pool of threads, so the compression runs on
+        all the cores while GIMP iterates the layers. zlib releases the GIL
+        while it compresses. `jobs` is the number of threads, or 0 for one
+        per core. At most two files per thread are waiting or being written,
+        save() blocks until one is done, so the pixels of all the layers are
+        not held at once. With `report_layers`, the size and time of each
+        file are printed to the standard output. `resolution` is the
+        (x, y) resolution in pixels per inch written to the files.
+    '''
+
+    def __init__(self, compression, jobs=0, report_layers=False, resolution=None):
+        self.compression = compression
+        self.resolution = resolution
+        self.report_layers = report_layers
+        self.saved_files = 0
+        threads = jobs or multiprocessing.cpu_count()
+        self.pool = ThreadPool(threads)
+        self.slots = threading.BoundedSemaphore(2 * threads)
+        self.pending = []
+
+    def save(self, fullpath, width, height, bpp, pixels):
+        self.slots.acquire()
+        result = self.pool.apply_async(
+            self.write, (fullpath, width, height, bpp, pixels))
+        self.pending.append((fullpath, result))
+
+    def write(self, fullpath, width, height, bpp, pixels):
+        try:
+            return write_png(fullpath, width, height, bpp, pixels, self.compression,
+                             self.resolution)
+        finally:
+            self.slots.release()
+
+    def saved(self, fullpath, seconds):
+        ''' Records a file written by GIMP. '''
+        self.pending.append((fullpath, seconds))
+
+    def close(self):
+        ''' Waits for all the files to be written. Returns the number of
+            bytes written.
+        '''
+        self.pool.close()
+        self.pool.join()
+        saved_bytes = 0
+        for fullpath, result in self.pending:
+            if isinstance(result, float):
+                size, seconds = os.path.getsize(fullpath), result
+            else:
+                size, seconds = result.get()
+            saved_bytes += size
+            if self.report_layers:
+                print('Saved %s: %d bytes in %.3f s' % (os.path.basename(fullpath), size, seconds))
+        self.saved_files += len(self.pending)
+        self.pending = []
+        return saved_bytes
+
+def alpha_bounds(layer):
+    ''' Returns the bounds (x, y, width, height) of the non-transparent
+        pixels of the layer, relative to the layer, or None if all of its
+        pixels are transparent.
+    '''
+    width, height = layer.width, layer.height
+    if not layer.has_alpha:
+        return 0, 0, width, height
+
+    region = layer.get_pixel_rgn(0, 0, width, height, False, False)
+    alpha = region[0:width, 0:height][region.bpp - 1::region.bpp]
+
+    # The first and last rows come from stripping the whole alpha channel,
+    # only the rows between them are scanned for the left and right edges
+    inner = alpha.strip('\x00')
+    if not inner:
+        return None
+    start = len(alpha) - len(alpha.lstrip('\x00'))
+    top = start // width
+    bottom = (start + len(inner) - 1) // width + 1
+    rows = [alpha[y * width:(y + 1) * width] for y in range(top, bottom)]
+
+    left = min(width - len(row.lstrip('\x00')) for row in rows)
+    right = max(len(row.rstrip('\x00')) for row in rows)
+    return left, top, right - left, bottom - top
+
+class AtlasRegions(object):
+    ''' The layers to pack into the atlas, by name. The trimmed bounds are
+        kept in image coordinates.
+    '''
+
+    def __init__(self):
+        self.names = []
+        self.regions = {}
+
+    def add(self, layer, crop, bounds=None):
+        ''' Adds the `crop` of the layer, trimmed to `bounds` if given or
+            else to the non-transparent pixels of the layer. Both are
+            relative to the layer.
+        '''
+        bounds = bounds or alpha_bounds(layer) or (0, 0, 1, 1)
+        x, y = layer.offsets
+        if layer.name not in self.regions:
+            self.names.append(layer.name)
+        # Layers with the same name save the same file, the last one is kept
+        self.regions[layer.name] = {
+            'name': layer.name,
+            'layer': layer,
+            'trim': (x + bounds[0], y + bounds[1], bounds[2], bounds[3]),
+            'offset': (bounds[0] - crop[0], crop[1] + crop[3] - bounds[1] - bounds[3]),
+            'orig': (crop[2], crop[3]),
+        }
+
+    def __iter__(self):
+        return (self.regions[name] for name in self.names)
+
+class MaxRectsPacker(object):
+    ''' Packs rectangles into a fixed size bin with the MaxRects algorithm,
+        placing each one by the best short side fit.
+    '''
+
+    def __init__(self, width, height):
+        self.free_rects = [(0, 0, width, height)]
+
+    def insert(self, width, height):
+        best = None
+        best_fit = None
+        for free_x, free_y, free_width, free_height in self.free_rects:
+            if width <= free_width and height <= free_height:
+                leftover_x = free_width - width
+                leftover_y = free_height - height
+                fit = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+                if best_fit is None or fit < best_fit:
+                    best = (free_x, free_y)
+                    best_fit = fit
+        if best is None:
+            return None
+        self.place((best[0], best[1], width, height))
+        return best
+
+    def place(self, rect):
+        x, y, width, height = rect
+        free_rects = []
+        for free in self.free_rects:
+            free_x, free_y, free_width, free_height = free
+            if (x >= free_x + free_width or x + width <= free_x or
+                    y >= free_y + free_height or y + height <= free_y):
+                free_rects.append(free)
+                continue
+            # Split the free rectangle into the parts around the placed one
+            if x > free_x:
+                free_rects.append((free_x, free_y, x - free_x, free_height))
+            if x + width < free_x + free_width:
+                free_rects.append((x + width, free_y, free_x + free_width - x - width, free_height))
+            if y > free_y:
+                free_rects.append((free_x, free_y, free_width, y - free_y))
+            if y + height < free_y + free_height:
+                free_rects.append((free_x, y + height, free_width, free_y + free_height - y - height))
+
+        # Drop the free rectangles contained in another one
+        self.free_rects = [
+            a for i, a in enumerate(free_rects)
+            if not any(
+                (j < i or a != b) and b[0] <= a[0] and b[1] <= a[1] and
+                a[0] + a[2] <= b[0] + b[2] and a[1] + a[3] <= b[1] + b[3]
+                for j, b in enumerate(free_rects) if j != i
+            )
+        ]
+
+def save_atlas(regions, compression, dir_name, name, max_size, padding):
+    ''' Packs the trimmed layers into power-of-two pages and writes them
+        with a Spine atlas file, `name`.atlas, in `dir_name`.
+    '''
+    if not os.path.isdir(dir_name):
+        os.makedirs(dir_name)
+
+    # Place the largest layers first, into the first page with enough space.
+    # The padding is added to the right and bottom of each layer, so the
+    # bin is larger by the padding.
+    packers = []
+    ordered = sorted(regions, reverse=True,
+                     key=lambda r: (max(r['trim'][2:]), r['trim'][2] * r['trim'][3]))
+    for region in ordered:
+        width, height = region['trim'][2:]
+        if width > max_size or height > max_size:
+            raise ValueError('The layer "%s" (%dx%d) is larger than the atlas page size %d'
+                             % (region['name'], width, height, max_size))
+        position = None
+        for page, packer in enumerate(packers):
+            position = packer.insert(width + padding, height + padding)
+            if position is not None:
+                region['page'] = page
+                break
+        if position is None:
+            packers.append(MaxRectsPacker(max_size + padding, max_size + padding))
+            region['page'] = len(packers) - 1
+            position = packers[-1].insert(width + padding, height + padding)
+        region['x'], region['y'] = position
+
+    lines = []
+    for page in range(len(packers)):
+        page_regions = [region for region in regions if region['page'] == page]
+        used_width = max(region['x'] + region['trim'][2] for region in page_regions)
+        used_height = max(region['y'] + region['trim'][3] for region in page_regions)
+        page_width = 1 << (used_width - 1).bit_length()
+        page_height = 1 << (used_height - 1).bit_length()
+
+        page_img = pdb.gimp_image_new(page_width, page_height, gimpfu.RGB)
+        for region in page_regions:
+            layer = region['layer']
+            left, top, width, height = region['trim']
+            x, y = layer.offsets
+            page_layer = pdb.gimp_layer_new_from_drawable(layer, page_img)
+            page_img.add_layer(page_layer, 0)
+            page_layer.visible = True
+            page_layer.opacity = 100.0
+            page_layer.mode = gimpfu.NORMAL_MODE
+            if not page_layer.has_alpha:
+                page_layer.add_alpha()
+            page_layer.resize(width, height, x - left, y - top)
+            page_layer.set_offsets(region['x'], region['y'])
+
+        page_layer = page_img.merge_visible_layers(gimpfu.CLIP_TO_IMAGE)
+        pdb.gimp_layer_resize_to_image_size(page_layer)
+        filename = '%s%s.png' % (name, page + 1 if page > 0 else '')
+        pdb.file_png_save(
+            page_img,
+            page_layer,
+            os.path.join(dir_name, filename),
+            filename,
+            0, # interlace
+            compression, # compression
+            0, # bkgd
+            0, # gama
+            0, # offs
+            0, # phys
+            0 # time
+        )
+        pdb.gimp_image_delete(page_img)
+
+        lines += [
+            '',
+            filename,
+            'size: %d,%d' % (page_width, page_height),
+            'format: RGBA8888',
+            'filter: Linear,Linear',
+            'repeat: none',
+        ]
+        for region in page_regions:
+            lines += [
+                region['name'],
+                '  rotate: false',
+                '  xy: %d, %d' % (region['x'], region['y']),
+                '  size: %d, %d' % region['trim'][2:],
+                '  orig: %d, %d' % region['orig'],
+                '  offset: %d, %d' % region['offset'],
+                '  index: -1',
+            ]
+
+    with open(os.path.join(dir_name, '%s.atlas' % name), 'w') as atlas_file:
+        atlas_file.write('\n'.join(lines) + '\n')
+
+def find_documents(inputs):
+    ''' Finds the .xcf files of the inputs, files or directories searched
+        recursively. Returns the file paths with their output directory
+        names, which are unique.
+    '''
+    documents = []
+    seen = set()
+    for path in inputs:
+        if os.path.isdir(path):
+            paths = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                paths.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.lower().endswith('.xcf'))
+            names = [os.path.splitext(os.path.relpath(p, path))[0] for p in paths]
+        else:
+            paths = [path]
+            names = [os.path.splitext(os.path.basename(path))[0]]
+        for doc_path, name in zip(paths, names):
+            doc_path = os.path.abspath(doc_path)
+            if doc_path not in seen:
+                seen.add(doc_path)
+                documents.append((doc_path, name))
+
+    used = set()
+    unique = []
+    for doc_path, name in documents:
+        unique_name = name
+        index = 2
+        while unique_name in used:
+            unique_name = '%s_%d' % (name, index)
+            index += 1
+        used.add(unique_name)
+        unique.append((doc_path, unique_name))
+    return unique
+
+def batch_worker(jobs_file, results_file):
+    ''' Exports the documents listed in `jobs_file` with the settings in
+        it, and writes the time and error of each one to `results_file`.
+        Runs in GIMP's batch interpreter, started by run_batch().
+    '''
+    with open(jobs_file) as f:
+        jobs = json.load(f)
+    settings = jobs['settings']
+
+    results = []
+    for path, output_dir in jobs['documents']:
+        # GIMP's procedures take byte strings
+        if not isinstance(path, str):
+            path = path.encode('utf-8')
+            output_dir = output_dir.encode('utf-8')
+        result = {'document': path, 'output': output_dir, 'status': 'ok', 'error': None}
+        start = time.time()
+        try:
+            if not os.path.isdir(output_dir):
+                os.makedirs(output_dir)
+            img = pdb.gimp_file_load(path, path)
+            try:
+                spine_export(img, img.active_layer, settings['compression'], output_dir,
+                             settings['crop_layers'], settings['pack_atlas'],
+                             settings['atlas_size'], settings['atlas_padding'],
+                             settings['jobs'], settings['dedup_images'],
+                             settings['report_layers'])
+            finally:
+                pdb.gimp_image_delete(img)
+        except Exception as error:
+            result['status'] = 'failed'
+            result['error'] = str(error) or type(error).__name__
+        result['seconds'] = time.time() - start
+        results.append(result)
+
+        # Written after each document, so a crash of GIMP keeps the results so far
+        with open(results_file, 'w') as f:
+            json.dump(results, f)
+
+def run_batch(argv):
+    ''' Exports directories of .xcf files from the command line, with
+        several GIMP processes in batch mode:
+        GimpToSpine.py batch [options] inputs...
+    '''
+    parser = argparse.ArgumentParser(
+        prog='GimpToSpine.py batch',
+        description='Export .xcf files to Spine with GIMP in batch mode.')
+    parser.add_argument('inputs', nargs='+', help='.xcf files or directories searched recursively')
+    parser.add_argument('--outdir', required=True,
+                        help='Output directory, each file is exported to a sub-directory named after it')
+    parser.add_argument('--compression', type=int, default=9, choices=range(10),
+                        help='PNG compression level')
+    parser.add_argument('--no-crop', dest='crop_layers', action='store_false',
+                        help='Export the layers without cropping them')
+    parser.add_argument('--pack-atlas', action='store_true', help='Pack the layers into an atlas')
+    parser.add_argument('--atlas-size', type=int, default=2048, choices=ATLAS_MAX_SIZES,
+                        help='Atlas page max size')
+    parser.add_argument('--atlas-padding', type=int, default=2, help='Atlas padding')
+    parser.add_argument('--dedup-images', action='store_true', help='Share identical images')
+    parser.add_argument('--report-layers', action='store_true',
+                        help='Print the size and time of each saved layer image')
+    parser.add_argument('--parallel', type=int, default=0,
+                        help='Number of GIMP processes (0 = one per CPU)')
+    parser.add_argument('--threads', type=int, default=1,
+                        help='PNG encoding threads of each GIMP process (0 = one per CPU)')
+    parser.add_argument('--gimp', default=os.environ.get('GIMP', 'gimp'),
+                        help='GIMP executable, also set by the GIMP environment variable')
+    parser.add_argument('--report', help='Write a JSON report of the timings and failures to this file')
+    options = parser.parse_args(argv)
+
+    documents = find_documents(options.inputs)
+    if not documents:
+        sys.stderr.write('No .xcf files found\n')
+        return 1
+    outdir = os.path.abspath(options.outdir)
+    settings = {
+        'compression': options.compression,
+        'crop_layers': options.crop_layers,
+        'pack_atlas': options.pack_atlas,
+        'atlas_size': ATLAS_MAX_SIZES.index(options.atlas_size),
+        'atlas_padding': options.atlas_padding,
+        'jobs': options.threads,
+        'dedup_images': options.dedup_images,
+        'report_layers': options.report_layers,
+    }
+
+    # Give each process about the same number of bytes to load, the largest files first
+    processes = options.parallel if options.parallel > 0 else multiprocessing.cpu_count()
+    parts = [[] for _ in range(min(processes, len(documents)))]
+    part_sizes = [0] * len(parts)
+    for path, name in sorted(documents, key=lambda d: os.path.getsize(d[0]) if os.path.isfile(d[0]) else 0,
+                             reverse=True):
+        index = part_sizes.index(min(part_sizes))
+        parts[index].append((path, os.path.join(outdir, name)))
+        part_sizes[index] += os.path.getsize(path) if os.path.isfile(path) else 0
+
+    temp_dir = tempfile.mkdtemp(prefix='gimp_spine_')
+    plugin_dir = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    lock = threading.Lock()
+
+    def export_part(index, part):
+        jobs_file = os.path.join(temp_dir, 'jobs%d.json' % index)
+        results_file = os.path.join(temp_dir, 'results%d.json' % index)
+        with open(jobs_file, 'w') as f:
+            json.dump({'settings': settings, 'documents': part}, f)
+        code = ('import sys; sys.path.insert(0, %r); import GimpToSpine; '
+                'GimpToSpine.batch_worker(%r, %r)' % (plugin_dir, jobs_file, results_file))
+        command = [options.gimp, '-i', '-d', '-f', '--batch-interpreter', 'python-fu-eval',
+                   '-b', code, '-b', 'pdb.gimp_quit(1)']
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = process.communicate()[0].decode('utf-8', 'replace')
+        except OSError as error:
+            output = 'Cannot start %s: %s' % (options.gimp, error)
+
+        try:
+            with open(results_file) as f:
+                part_results = json.load(f)
+        except (IOError, OSError, ValueError):
+            part_results = []
+        # The documents without a result were not exported, GIMP failed or stopped before them
+        done = set(result['document'] for result in part_results)
+        error = output.strip().splitlines()[-1] if output.strip() else 'GIMP exited without a result'
+        for path, output_dir in part:
+            if path not in done:
+                part_results.append({'document': path, 'output': output_dir, 'status': 'failed',
+                                     'error': error, 'seconds': 0.0})
+
+        with lock:
+            if options.report_layers:
+                sys.stderr.write(output)
+            for result in part_results:
+                sys.stderr.write('%s %s (%.2f s)%s\n' % (
+                    'Exported' if result['status'] == 'ok' else 'FAILED', result['document'],
+                    result['seconds'], ': ' + result['error'] if result['error'] else ''))
+            results.extend(part_results)
+
+    start = time.time()
+    threads = [threading.Thread(target=export_part, args=(index, part)) for index, part in enumerate(parts)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+    total_seconds = time.time() - start
+
+    failed = [result for result in results if result['status'] != 'ok']
+    sys.stderr.write('Exported %d of %d files in %.2f s with %d GIMP processes, %d failed\n' % (
+        len(results) - len(failed), len(results), total_seconds, len(parts), len(failed)))
+    for result in failed:
+        sys.stderr.write('  %s: %s\n' % (result['document'], result['error']))
+
+    if options.report:
+        report = {
+            'documents': len(results),
+            'failed': len(failed),
+            'seconds': total_seconds,
+            'parallel': len(parts),
+            'settings': settings,
+            'results': results,
+        }
+        with open(options.report, 'w') as f:
+            json.dump(report, f, indent=1)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__' and gimpfu is None:
+    sys.exit(run_batch(sys.argv[2:] if sys.argv[1:2] == ['batch'] else sys.argv[1:]))
+
+if gimpfu is not None:
+    gimpfu.register(
+        # name
+        "spine-export",
+        # blurb
+        "Spine export",
+        # help
+        "Exports layers to images and outputs a Spine JSON file",
+        # author
+        "Carlo Cabanilla",
+        # copyright
+        "Carlo Cabanilla",
+        # date
+        "2014",
+        # menupath
+        "<Image>/File/Export/Export to Spine",
+        # imagetypes
+        "*",
+        # params
+        [
+            (gimpfu.PF_ADJUSTMENT, "compression", "PNG Compression level:", 9, (0, 9, 1)),
+            (gimpfu.PF_DIRNAME, "dir", "Directory", "/tmp"),
+            (gimpfu.PF_TOGGLE, "crop_layers", "Crop", 1),
+            (gimpfu.PF_TOGGLE, "pack_atlas", "Pack atlas", 0),
+            (gimpfu.PF_OPTION, "atlas_size", "Atlas page max size", 2, [str(size) for size in ATLAS_MAX_SIZES]),
+            (gimpfu.PF_SPINNER, "atlas_padding", "Atlas padding", 2, (0, 16, 1)),
+            (gimpfu.PF_SPINNER, "jobs", "PNG encoding threads (0 for all cores)", 0, (0, 64, 1)),
+            (gimpfu.PF_TOGGLE, "dedup_images", "Share identical images", 0),
+        ],
+        # results
+        [],
+        # function
+        spine_export
+    )
 
-gimpfu.register(
-    # name
-    "spine-export",
-    # blurb
-    "Spine export",
-    # help
-    "Exports layers to images and outputs a Spine JSON file",
-    # author
-    "Carlo Cabanilla",
-    # copyright
-    "Carlo Cabanilla",
-    # date
-    "2014",
-    # menupath
-    "<Image>/File/Export/Export to Spine",
-    # imagetypes
-    "*",
-    # params
-    [
-        (gimpfu.PF_ADJUSTMENT, "compression", "PNG Compression level:", 9, (0, 9, 1)),
-        (gimpfu.PF_DIRNAME, "dir", "Directory", "/tmp"),
-        (gimpfu.PF_TOGGLE, "crop_layers", "Crop", 1),
-    ],
-    # results
-    [],
-    # function
-    spine_export
-)
-
-gimpfu.main()
+    if __name__ == '__main__':
+        gimpfu.main()
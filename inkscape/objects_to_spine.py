@@ -20,23 +20,325 @@ v1.0 @metaphore
     - Option to center the content.
 """
 
+import argparse
+import glob
+import hashlib
+import math
 import os
+import re
+import struct
+import subprocess
+import sys
+import threading
+import time
+import zlib
 
 import inkex
 import json
 
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
 from inkex import BaseElement
-from inkex.command import inkscape
+from lxml import etree
+from inkex.command import inkscape, INKSCAPE_EXECUTABLE_NAME
 from inkex.utils import debug, AbortExtension
 
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 INKSCAPE_LABEL = "{%s}label" % (inkex.NSS["inkscape"])
 
+# Keep the batch render command line well below the Windows limit of 8191 characters.
+MAX_ACTIONS_LENGTH = 7000
+
+# The incremental export manifest, written to the output directory.
+MANIFEST_FILE = ".spine_export_manifest.json"
+MANIFEST_VERSION = 1
+
+# Elements whose geometric bounding box, computed by inkex, matches the one reported by Inkscape.
+# Any other element (text, clones, etc.) in the subtree makes the exporter ask Inkscape instead.
+BBOX_SHAPE_TAGS = {
+    inkex.addNS(tag, "svg")
+    for tag in ("g", "path", "rect", "circle", "ellipse", "line", "polyline", "polygon", "image")
+}
+BBOX_IGNORED_TAGS = {inkex.addNS(tag, "svg") for tag in ("title", "desc", "metadata")}
+# Properties that make the visual bounding box larger or smaller than the geometric one.
+# Markers are rendered even without a stroke.
+BBOX_VISUAL_PROPERTIES = ("filter", "clip-path", "mask", "marker", "marker-start", "marker-mid", "marker-end")
+
+# References to other elements: url(#id) in styles and attributes, and href="#id".
+ELEMENT_REFERENCE = re.compile(r"url\(\s*['\"]?#([^)'\"\s]+)|href=\"#([^\"]+)\"")
+
+# The "display" declarations of a style attribute, and the rules of a stylesheet.
+STYLE_DISPLAY = re.compile(r"(?:^|;)\s*display\s*:([^;]*)")
+CSS_COMMENT = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_RULE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+CSS_SIMPLE_SELECTOR = re.compile(r"^([.#])([\w-]+)$")
+
+ATLAS_MAX_SIZES = (512, 1024, 2048, 4096, 8192)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# The PNG chunks that define the pixels of an image, the others are metadata.
+PNG_PIXEL_CHUNKS = {b"IHDR", b"PLTE", b"tRNS"}
+
+# Setting this environment variable to a non-empty value other than "0" enables the profiling, like "--profile".
+PROFILE_ENV = "SPINE_EXPORT_PROFILE"
+# The profile trace, written to the output directory.
+TRACE_FILE = "spine_export_trace.json"
+
+
+@dataclass
+class ExportImage:
+    """
+    An object to be rendered to an image, with the data to register its attachment.
+    """
+    node_id: str
+    image_file: str
+    bbox: tuple[float, float, float, float]
+    slot_name: str
+    attach_name: str
+    attach_path: str | None
+    # Hash of everything that affects the rendered image, used by the incremental export.
+    content_hash: str | None = None
+    # The image file from a previous export is up-to-date and doesn't need to be rendered.
+    reused: bool = False
+
+
+@dataclass
+class AtlasRegion:
+    """
+    A trimmed image placed on an atlas page.
+    """
+    name: str
+    image_file: str
+    # The non-transparent part of the image, relative to its top left corner.
+    trim: tuple[int, int, int, int]
+    # The original image size.
+    orig: tuple[int, int]
+    page: int = 0
+    x: int = 0
+    y: int = 0
+
+
+class MaxRectsPacker:
+    """
+    Packs rectangles into a fixed size bin with the MaxRects algorithm, placing each one by the best short side fit.
+    The free space is kept as a list of maximal, possibly overlapping, free rectangles.
+    """
+
+    def __init__(self, width: int, height: int):
+        self.free_rects: list[tuple[int, int, int, int]] = [(0, 0, width, height)]
+
+    def insert(self, width: int, height: int) -> tuple[int, int] | None:
+        best = None
+        best_fit = None
+        for free_x, free_y, free_width, free_height in self.free_rects:
+            if width <= free_width and height <= free_height:
+                leftover_x = free_width - width
+                leftover_y = free_height - height
+                fit = (min(leftover_x, leftover_y), max(leftover_x, leftover_y))
+                if best_fit is None or fit < best_fit:
+                    best = (free_x, free_y)
+                    best_fit = fit
+        if best is None:
+            return None
+        self.place((best[0], best[1], width, height))
+        return best
+
+    def place(self, rect: tuple[int, int, int, int]):
+        x, y, width, height = rect
+        free_rects = []
+        for free in self.free_rects:
+            free_x, free_y, free_width, free_height = free
+            if x >= free_x + free_width or x + width <= free_x or y >= free_y + free_height or y + height <= free_y:
+                free_rects.append(free)
+                continue
+            # Split the free rectangle into the (up to four) parts around the placed one.
+            if x > free_x:
+                free_rects.append((free_x, free_y, x - free_x, free_height))
+            if x + width < free_x + free_width:
+                free_rects.append((x + width, free_y, free_x + free_width - x - width, free_height))
+            if y > free_y:
+                free_rects.append((free_x, free_y, free_width, y - free_y))
+            if y + height < free_y + free_height:
+                free_rects.append((free_x, y + height, free_width, free_y + free_height - y - height))
+
+        # Drop the free rectangles contained in another one.
+        self.free_rects = [
+            a for i, a in enumerate(free_rects)
+            if not any(
+                (j < i or a != b) and b[0] <= a[0] and b[1] <= a[1]
+                and a[0] + a[2] <= b[0] + b[2] and a[1] + a[3] <= b[1] + b[3]
+                for j, b in enumerate(free_rects) if j != i
+            )
+        ]
+
+
+class ExportProfiler:
+    """
+    Records the wall time and the number of Inkscape calls of the export phases,
+    and the time spent on each node and the Inkscape calls it took part in.
+    The phases follow one another: starting a phase ends the previous one.
+    The events are written in the Chrome trace event format (chrome://tracing, https://ui.perfetto.dev).
+    """
+
+    def __init__(self):
+        self.origin = time.time()
+        self.lock = threading.Lock()
+        self.events: list[dict] = []
+        self.thread_ids: dict[int, int] = {}
+        self.phase_name: str | None = None
+        self.phase_start = 0.0
+        # Seconds, Inkscape processes and Inkscape shell calls of each phase, by name.
+        self.phase_totals: dict[str, dict[str, float]] = {}
+        # Seconds of each node, by id and phase.
+        self.node_totals: dict[str, dict[str, float]] = {}
+        # Inkscape processes and Inkscape shell calls of each node, by id. A batch call counts for each of its nodes.
+        self.node_calls: dict[str, dict[str, int]] = {}
+
+    def start_phase(self, name: str | None):
+        now = time.time()
+        if self.phase_name is not None:
+            self.add_event(self.phase_name, "phase", self.phase_start, now)
+            self.get_phase_totals(self.phase_name)["seconds"] += now - self.phase_start
+        self.phase_name = name
+        self.phase_start = now
+
+    def get_phase_totals(self, name: str) -> dict[str, float]:
+        return self.phase_totals.setdefault(name, {"seconds": 0.0, "processes": 0, "shell_calls": 0})
+
+    def add_node_event(self, name: str, node_id: str, start: float, end: float, args: dict | None = None):
+        self.add_event(name, "node", start, end, dict(args or {}, node=node_id))
+        with self.lock:
+            node_phases = self.node_totals.setdefault(node_id, {})
+            node_phases[name] = node_phases.get(name, 0.0) + end - start
+
+    def count_inkscape_call(self, shell: bool = False, node_ids: list[str] = ()):
+        key = "shell_calls" if shell else "processes"
+        with self.lock:
+            self.get_phase_totals(self.phase_name or "other")[key] += 1
+            for node_id in node_ids:
+                self.node_calls.setdefault(node_id, {"processes": 0, "shell_calls": 0})[key] += 1
+
+    def add_event(self, name: str, category: str, start: float, end: float, args: dict | None = None):
+        with self.lock:
+            thread_id = self.thread_ids.setdefault(threading.get_ident(), len(self.thread_ids) + 1)
+            self.events.append({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": round((start - self.origin) * 1e6),
+                "dur": round((end - start) * 1e6),
+                "pid": os.getpid(),
+                "tid": thread_id,
+                "args": args or {},
+            })
+
+    def write_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+    def summary(self, top: int) -> list[str]:
+        lines = ["Export phases:"]
+        for name, totals in self.phase_totals.items():
+            lines.append("  %-12s %8.3f s, %d Inkscape processes, %d Inkscape shell calls"
+                         % (name, totals["seconds"], totals["processes"], totals["shell_calls"]))
+        slowest = sorted(self.node_totals.items(), key=lambda item: sum(item[1].values()), reverse=True)[:top]
+        if slowest:
+            lines.append("Slowest %d nodes:" % len(slowest))
+        for node_id, node_phases in slowest:
+            calls = self.node_calls.get(node_id, {"processes": 0, "shell_calls": 0})
+            lines.append("  %-24s %8.3f s (%s), %d Inkscape processes, %d Inkscape shell calls" % (
+                node_id, sum(node_phases.values()),
+                ", ".join("%s %.3f s" % (name, seconds) for name, seconds in node_phases.items()),
+                calls["processes"], calls["shell_calls"]))
+        return lines
+
+
+class InkscapeShell:
+    """
+    A persistent "inkscape --shell" process. It runs action lists on any number of documents
+    without starting Inkscape for each one. Not thread-safe, use one per thread.
+    """
+
+    prompt = b"> "
+
+    def __init__(self):
+        self.process: subprocess.Popen | None = None
+
+    def run(self, actions: str) -> str:
+        """
+        Run a line of actions and return their output.
+        """
+        if self.process is None or self.process.poll() is not None:
+            self.process = subprocess.Popen(
+                [INKSCAPE_EXECUTABLE_NAME, "--shell"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            self.read_output()
+        self.process.stdin.write(actions.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+        return self.read_output()
+
+    def read_output(self) -> str:
+        # The shell prints the prompt at the start of a line when it's ready for the next actions.
+        output = b""
+        while not (output == self.prompt or output.endswith(b"\n" + self.prompt)):
+            data = os.read(self.process.stdout.fileno(), 65536)
+            if not data:
+                raise RuntimeError("The Inkscape shell exited unexpectedly")
+            output += data
+        return output[:-len(self.prompt)].decode("utf-8", "replace")
+
+    def close(self):
+        if self.process is None:
+            return
+        try:
+            self.process.communicate(b"quit\n", timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+    @staticmethod
+    def accepts(*values: str) -> bool:
+        # A semicolon separates the actions and a line break ends the list.
+        return not any(";" in value or "\n" in value for value in values)
+
 
 class SpineExporter(inkex.EffectExtension):
 
     mode_selected_objects = "selected_objects"
     mode_visible_layers = "visible_layers"
 
+    render_mode_batch = "batch"
+    render_mode_per_node = "per_node"
+
+    bbox_mode_inkscape = "inkscape"
+    bbox_mode_hybrid = "hybrid"
+    bbox_mode_verify = "verify"
+
+    def __init__(self):
+        super().__init__()
+        # Bounding boxes of all the document objects by id, queried on the first use.
+        self.bbox_cache: dict[str, tuple[float, float, float, float]] | None = None
+        # How many bounding boxes were computed in Python or queried from Inkscape, and verification mismatches.
+        self.bbox_counts = {"python": 0, "inkscape": 0, "mismatched": 0}
+        # Whether the document has stylesheets, checked on the first use.
+        self.has_stylesheets: bool | None = None
+        # Render time of each image file in seconds.
+        self.render_timings: dict[str, float] = {}
+        # The images of the last export.
+        self.images: list[ExportImage] = []
+        # Run the Inkscape actions in this shell instead of starting Inkscape for each call (see run_batch()).
+        self.inkscape_shell: InkscapeShell | None = None
+        self.profiler = ExportProfiler()
+
     def add_arguments(self, pars):
         pars.add_argument("--tab")
         pars.add_argument(
@@ -95,6 +397,97 @@ class SpineExporter(inkex.EffectExtension):
             dest="compact_names",
             help="Slots and attachments will be shortened",
         )
+        pars.add_argument(
+            "--atlas",
+            type=inkex.Boolean,
+            dest="atlas",
+            default=False,
+            help="Pack the images into a texture atlas",
+        )
+        pars.add_argument(
+            "--atlas-max-size",
+            type=int,
+            dest="atlas_max_size",
+            default=2048,
+            help="Maximum width and height of an atlas page (supported sizes: %s)"
+                 % ", ".join(str(size) for size in ATLAS_MAX_SIZES)
+        )
+        pars.add_argument(
+            "--atlas-padding",
+            type=int,
+            dest="atlas_padding",
+            default=2,
+            help="Pixels between the images on an atlas page",
+        )
+        pars.add_argument(
+            "--dedup-images",
+            type=inkex.Boolean,
+            dest="dedup_images",
+            default=False,
+            help="Write pixel-identical images once and share them between the attachments",
+        )
+        pars.add_argument(
+            "--bbox-mode",
+            action="store",
+            type=str,
+            dest="bbox_mode",
+            default=self.bbox_mode_inkscape,
+            help="Get bounding boxes from Inkscape (\"%s\"), compute them in Python where possible (\"%s\") "
+                 "or compute them and compare against Inkscape (\"%s\")"
+                 % (self.bbox_mode_inkscape, self.bbox_mode_hybrid, self.bbox_mode_verify)
+        )
+        pars.add_argument(
+            "--bbox-tolerance",
+            type=float,
+            dest="bbox_tolerance",
+            default=0.5,
+            help="The largest difference in px allowed by the bounding box verification",
+        )
+        pars.add_argument(
+            "--incremental",
+            type=inkex.Boolean,
+            dest="incremental",
+            default=False,
+            help="Only render the objects that have changed since the previous export",
+        )
+        pars.add_argument(
+            "--render-mode",
+            action="store",
+            type=str,
+            dest="render_mode",
+            default=self.render_mode_batch,
+            help="Render all the images in one Inkscape process (\"%s\") or each one separately (\"%s\")"
+                 % (self.render_mode_batch, self.render_mode_per_node)
+        )
+        pars.add_argument(
+            "--jobs",
+            type=int,
+            dest="jobs",
+            default=1,
+            help="Number of Inkscape processes rendering at the same time (0 = one per CPU)",
+        )
+        pars.add_argument(
+            "--report-timings",
+            type=inkex.Boolean,
+            dest="report_timings",
+            default=False,
+            help="Report the render time of each image",
+        )
+        pars.add_argument(
+            "--profile",
+            type=inkex.Boolean,
+            dest="profile",
+            default=False,
+            help="Write a trace of the export phases and nodes to \"%s\" in the output directory "
+                 "and list the slowest nodes (also enabled by the %s environment variable)" % (TRACE_FILE, PROFILE_ENV),
+        )
+        pars.add_argument(
+            "--profile-top",
+            type=int,
+            dest="profile_top",
+            default=10,
+            help="Number of the slowest nodes listed by the profiling",
+        )
 
     # Prevent the original document modification.
     def has_changed(self, ret):
@@ -104,10 +497,12 @@ class SpineExporter(inkex.EffectExtension):
         # Delete all the invisible nodes in the document.
         # This is required, due to the node's rendering clips off the hidden sub-nodes.
         # But the Inkex's bounding box still includes the hidden sub-nodes.
+        self.profiler.start_phase("prune")
         self.delete_invisible_children(self.svg)
 
         export_mode = self.options.export_mode
-        
+        self.profiler.start_phase("collect")
+
         if export_mode == self.mode_selected_objects:
             nodes = self.collect_selected_nodes()
             self.export_nodes(nodes)
@@ -119,6 +514,14 @@ class SpineExporter(inkex.EffectExtension):
         else:
             raise NotImplementedError("Unexpected export mode: " + export_mode)
 
+        self.profiler.start_phase(None)
+        if self.options.profile or os.environ.get(PROFILE_ENV, "0") not in ("", "0"):
+            trace_file = os.path.join(os.path.expanduser(self.options.outdir), TRACE_FILE)
+            self.profiler.write_trace(trace_file)
+            for line in self.profiler.summary(self.options.profile_top):
+                debug(line)
+            debug("Trace written to %s" % trace_file)
+
     def collect_layers(self) -> list[BaseElement]:
         xpath = "./svg:g[@inkscape:groupmode='layer']"
 
@@ -144,7 +547,8 @@ class SpineExporter(inkex.EffectExtension):
     def collect_selected_nodes(self) -> list[BaseElement]:
         selected_nodes = self.svg.selection.rendering_order()
         # Filter out invisible objects.
-        selected_nodes = list(filter(lambda node: not self.is_hidden(node), selected_nodes))
+        hidden_classes, hidden_ids = self.get_hidden_selectors()
+        selected_nodes = [node for node in selected_nodes if not self.is_hidden(node, hidden_classes, hidden_ids)]
         if len(selected_nodes) == 0:
             raise AbortExtension("Nothing is selected.")
         return selected_nodes
@@ -154,6 +558,12 @@ class SpineExporter(inkex.EffectExtension):
         if image_prefix:
             image_prefix = image_prefix.replace("\\", "/").strip()
 
+        if self.options.atlas:
+            if Image is None:
+                raise AbortExtension("Packing a texture atlas requires the Pillow Python package")
+            if self.options.atlas_max_size not in ATLAS_MAX_SIZES:
+                raise AbortExtension("Unexpected atlas page size: %d" % self.options.atlas_max_size)
+
         output_dir = os.path.expanduser(self.options.outdir)
         images_dir = os.path.join(output_dir, "images")
         if not os.path.isdir(images_dir):
@@ -166,13 +576,14 @@ class SpineExporter(inkex.EffectExtension):
             "skins": [{"name": "default", "attachments": {}}],
             "animations": {"animation": {}},
         }
+        # Name indexes of the bones, slots and skins, so the lookups don't scan the lists.
+        skel_index = self.index_skeleton(skel_struct)
 
-        for node in nodes:
+        manifest = self.load_manifest(output_dir) if self.options.incremental else {}
 
-            bbox = self.get_bounding_box(node)
-            # Object may have no bounding box in case it's content is empty or invisible.
-            if bbox is None:
-                continue
+        self.profiler.start_phase("bbox")
+        images = []
+        for node in nodes:
 
             # Inkscape uses the "inkscape:label" attribute to display the name
             # (the one you see and edit in the "Layers and Objects" window).
@@ -186,22 +597,28 @@ class SpineExporter(inkex.EffectExtension):
                 full_name = image_prefix + full_name
 
             image_file = os.path.join(images_dir, "%s.png" % full_name)
+            image_key = os.path.relpath(image_file, images_dir).replace("\\", "/")
+
+            content_hash = None
+            reused = False
+            if self.options.incremental:
+                start = time.time()
+                content_hash = self.get_content_hash(node, image_key)
+                self.profiler.add_node_event("hash", node.get_id(), start, time.time())
+                record = manifest.get(image_key)
+                reused = record is not None and record["hash"] == content_hash and os.path.isfile(image_file)
+
+            start = time.time()
+            bbox = tuple(manifest[image_key]["bbox"]) if reused else self.get_bounding_box(node)
+            self.profiler.add_node_event("bbox", node.get_id(), start, time.time())
+            # Object may have no bounding box in case it's content is empty or invisible.
+            if bbox is None:
+                continue
+
             image_file_parent = os.path.dirname(image_file)
             if not os.path.exists(image_file_parent):
                 os.makedirs(image_file_parent)
 
-            # Render the object.
-            inkex.command.inkscape(
-                self.options.input_file,
-                **{
-                    "export-filename": image_file,
-                    "export-id": node.get_id(),
-                    "export-id-only": None,
-                    "export-overwrite": None,
-                    "export-text-to-path": None, # Do we need this?
-                }
-            )
-
             attach_name = full_name
             attach_path = None
             if self.options.compact_names:
@@ -211,18 +628,53 @@ class SpineExporter(inkex.EffectExtension):
                 attach_path = os.path.relpath(image_file, images_dir)[:-4].replace("\\", "/")
             slot_name = attach_name
 
-            self.register_image_attachment(skel_struct, slot_name, attach_name, attach_path, bbox)
+            images.append(ExportImage(
+                node.get_id(), image_file, bbox, slot_name, attach_name, attach_path, content_hash, reused
+            ))
+
+        if self.options.bbox_mode != self.bbox_mode_inkscape or self.options.report_timings:
+            debug("Bounding boxes: %d computed, %d queried from Inkscape, %d mismatched"
+                  % (self.bbox_counts["python"], self.bbox_counts["inkscape"], self.bbox_counts["mismatched"]))
+
+        self.images = images
+
+        # Render the objects.
+        self.profiler.start_phase("render")
+        self.render_images([image for image in images if not image.reused])
+        self.profiler.start_phase("manifest")
+        if self.options.incremental:
+            # Only the exported images are kept, the records of the objects that are gone are dropped.
+            manifest = {}
+            for image in images:
+                image_key = os.path.relpath(image.image_file, images_dir).replace("\\", "/")
+                manifest[image_key] = {"hash": image.content_hash, "bbox": list(image.bbox)}
+            self.save_manifest(output_dir, manifest)
+        if self.options.report_timings:
+            for image in images:
+                if image.reused:
+                    debug("Unchanged %s" % image.image_file)
+                    continue
+                debug("Rendered %s in %.3f s" % (image.image_file, self.render_timings.get(image.image_file, 0.0)))
+
+        if self.options.dedup_images:
+            self.profiler.start_phase("dedup")
+            self.share_duplicate_images(images, images_dir)
+
+        self.profiler.start_phase("attachments")
+        for image in images:
+            self.register_image_attachment(skel_struct, skel_index, image.slot_name, image.attach_name, image.attach_path, image.bbox)
+
+        if self.options.atlas:
+            self.profiler.start_phase("atlas")
+            self.pack_atlas(images, images_dir, output_dir, self.get_skeleton_name())
 
         # Create Skeleton JSON file.
         if self.options.create_json:
+            self.profiler.start_phase("json")
             if self.options.center_content:
                 self.center_skel_content(skel_struct)
 
-            # If user hasn't provided the skeleton name, use the document name instead.
-            skel_name = self.options.skel_name
-            if not skel_name or skel_name.isspace():
-                skel_name = self.get_document_name()
-            path = os.path.join(output_dir, "%s.json" % skel_name)
+            path = os.path.join(output_dir, "%s.json" % self.get_skeleton_name())
             if self.options.pretty:
                 args = {"separators": (",", ": "), "indent": 4}
             else:
@@ -231,6 +683,346 @@ class SpineExporter(inkex.EffectExtension):
             with open(path, "w") as f:
                 json.dump(skel_struct, f, **args)
 
+    @staticmethod
+    def load_manifest(output_dir: str) -> dict[str, dict]:
+        """
+        Load the image records of the previous export: the content hash and the bbox of each image,
+        by the image path relative to the images directory.
+        """
+        try:
+            with open(os.path.join(output_dir, MANIFEST_FILE), "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("images", {})
+
+    @staticmethod
+    def save_manifest(output_dir: str, images: dict[str, dict]):
+        with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "images": images}, f, indent=1, sort_keys=True)
+
+    def get_content_hash(self, node: BaseElement, image_key: str) -> str:
+        """
+        Hash everything that affects the rendered image of the node:
+        the export parameters, the document size, the ancestors (transforms and inherited styles),
+        the node's subtree, the stylesheets, the referenced definitions and any linked image files.
+        """
+        content = hashlib.sha1()
+
+        def add(*values):
+            for value in values:
+                content.update(value if isinstance(value, bytes) else str(value).encode("utf-8"))
+                content.update(b"\0")
+
+        add(MANIFEST_VERSION, image_key, node.get_id(), "export-id-only", "export-text-to-path")
+
+        # The ancestors' attributes also reference definitions, e.g. the filter, clip or mask of a layer.
+        ancestor_attributes = []
+        for ancestor in reversed(list(node.iterancestors())):
+            add(ancestor.tag, sorted(ancestor.attrib.items()))
+            ancestor_attributes.append(
+                "".join(" %s=\"%s\"" % item for item in ancestor.attrib.items()).encode("utf-8")
+            )
+
+        subtree = etree.tostring(node)
+        add(subtree)
+
+        for style in self.svg.xpath("//svg:style", namespaces=inkex.NSS):
+            add(style.text or "")
+
+        # Follow the references from the subtree and the ancestors, including the references between the definitions.
+        pending = [subtree] + ancestor_attributes
+        visited = set()
+        while pending:
+            for match in ELEMENT_REFERENCE.finditer(pending.pop().decode("utf-8")):
+                ref_id = match.group(1) or match.group(2)
+                if ref_id in visited:
+                    continue
+                visited.add(ref_id)
+                ref_elem = self.svg.getElementById(ref_id)
+                if ref_elem is not None:
+                    ref_content = etree.tostring(ref_elem)
+                    add(ref_id, ref_content)
+                    pending.append(ref_content)
+
+        # Linked (not embedded) images may change without the document changing.
+        doc_dir = os.path.dirname(os.path.abspath(self.options.input_file))
+        for image in node.iter("{%s}image" % inkex.NSS["svg"]):
+            href = image.get("{%s}href" % inkex.NSS["xlink"]) or image.get("href") or ""
+            if href and not href.startswith("data:"):
+                image_path = os.path.join(doc_dir, href[7:] if href.startswith("file://") else href)
+                if os.path.isfile(image_path):
+                    stat = os.stat(image_path)
+                    add(href, stat.st_mtime, stat.st_size)
+
+        return content.hexdigest()
+
+    def render_images(self, images: list[ExportImage]):
+        jobs = self.options.jobs if self.options.jobs > 0 else os.cpu_count() or 1
+        if self.inkscape_shell is not None:
+            jobs = 1
+        jobs = min(jobs, len(images))
+        if jobs <= 1:
+            self.render_image_group(images)
+            return
+
+        # Each worker renders a contiguous part of the images with its own Inkscape process.
+        # The attachments are registered afterwards in the original order, so the draw order is not affected.
+        part_size = math.ceil(len(images) / jobs)
+        parts = [images[i:i + part_size] for i in range(0, len(images), part_size)]
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            futures = [executor.submit(self.render_image_group, part) for part in parts]
+            for future in futures:
+                future.result()
+
+    def render_image_group(self, images: list[ExportImage]):
+        render_mode = self.options.render_mode
+
+        if render_mode == self.render_mode_per_node:
+            for image in images:
+                self.render_image(image)
+
+        elif render_mode == self.render_mode_batch:
+            self.render_batch(images)
+
+        else:
+            raise NotImplementedError("Unexpected render mode: " + render_mode)
+
+    def render_image(self, image: ExportImage):
+        start = time.time()
+        self.profiler.count_inkscape_call(node_ids=[image.node_id])
+        inkscape(
+            self.options.input_file,
+            **{
+                "export-filename": image.image_file,
+                "export-id": image.node_id,
+                "export-id-only": None,
+                "export-overwrite": None,
+                "export-text-to-path": None, # Do we need this?
+            }
+        )
+        self.render_timings[image.image_file] = time.time() - start
+        self.profiler.add_node_event("render", image.node_id, start, start + self.render_timings[image.image_file],
+                                     {"inkscape_processes": 1})
+
+    def render_batch(self, images: list[ExportImage]):
+        """
+        Render the images with an action list, so Inkscape loads the document once for many images.
+        The export options are the same as in render_image(), so both produce the same files.
+        """
+        batch = []
+        for image in images:
+            # A semicolon separates the actions, so such ids and file names can't be a part of the list.
+            if ";" in image.node_id or ";" in image.image_file:
+                self.render_image(image)
+            else:
+                batch.append(image)
+
+        chunk = []
+        chunk_length = 0
+        for image in batch:
+            actions = self.export_actions(image)
+            if chunk and chunk_length + len(actions) > MAX_ACTIONS_LENGTH:
+                self.render_actions(chunk)
+                chunk = []
+                chunk_length = 0
+            chunk.append(image)
+            chunk_length += len(actions)
+        if chunk:
+            self.render_actions(chunk)
+
+    @staticmethod
+    def export_actions(image: ExportImage) -> str:
+        return (
+            "export-id:%s;export-id-only;export-overwrite;export-text-to-path;export-filename:%s;export-do;"
+            % (image.node_id, image.image_file)
+        )
+
+    def render_actions(self, images: list[ExportImage]):
+        start = time.time()
+        actions = "".join(self.export_actions(image) for image in images)
+        node_ids = [image.node_id for image in images]
+        shell = self.inkscape_shell is not None and self.inkscape_shell.accepts(self.options.input_file)
+        self.profiler.count_inkscape_call(shell, node_ids)
+        if shell:
+            self.inkscape_shell.run("file-open:%s;%sfile-close" % (self.options.input_file, actions))
+        else:
+            inkscape(
+                self.options.input_file,
+                **{
+                    "actions": actions,
+                }
+            )
+
+        # The images are written one after another, in the given order.
+        # The time between the files being written is the render time of each image.
+        # The first one also includes the document loading.
+        previous = start
+        for image in images:
+            written = os.path.getmtime(image.image_file) if os.path.exists(image.image_file) else previous
+            self.render_timings[image.image_file] = max(0.0, written - previous)
+            self.profiler.add_node_event(
+                "render", image.node_id, previous, previous + self.render_timings[image.image_file],
+                {"inkscape_shell_calls" if shell else "inkscape_processes": 1, "batch_size": len(images)}
+            )
+            previous = max(previous, written)
+
+    @staticmethod
+    def get_image_hash(image_file: str) -> str | None:
+        """
+        Hash the pixels of a PNG image: its header, palette, transparency and decompressed image data.
+        Images that only differ in the metadata chunks (text, time, resolution, etc.) have the same hash.
+        Return None if the file can't be read.
+        """
+        try:
+            with open(image_file, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if not data.startswith(PNG_SIGNATURE):
+            return None
+
+        content = hashlib.sha1()
+        image_data = []
+        offset = len(PNG_SIGNATURE)
+        while offset + 8 <= len(data):
+            length, kind = struct.unpack(">I4s", data[offset:offset + 8])
+            chunk = data[offset + 8:offset + 8 + length]
+            if kind in PNG_PIXEL_CHUNKS:
+                content.update(kind + chunk)
+            elif kind == b"IDAT":
+                image_data.append(chunk)
+            elif kind == b"IEND":
+                break
+            offset += length + 12
+        try:
+            content.update(zlib.decompress(b"".join(image_data)))
+        except zlib.error:
+            return None
+        return content.hexdigest()
+
+    def share_duplicate_images(self, images: list[ExportImage], images_dir: str):
+        """
+        Point the attachments of pixel-identical images at the first of them, with the attachment "path",
+        and delete the other image files. Each unique image is then written and packed into the atlas once.
+        """
+        # The first image file of each hash, and the shared image file of each deleted duplicate.
+        originals: dict[str, str] = {}
+        duplicates: dict[str, str] = {}
+        hashed = set()
+        for image in images:
+            if image.image_file not in hashed:
+                hashed.add(image.image_file)
+                image_hash = self.get_image_hash(image.image_file)
+                if image_hash is not None:
+                    original = originals.setdefault(image_hash, image.image_file)
+                    if original != image.image_file:
+                        duplicates[image.image_file] = original
+                        os.remove(image.image_file)
+
+            original = duplicates.get(image.image_file)
+            if original is not None:
+                image.attach_path = os.path.relpath(original, images_dir)[:-4].replace("\\", "/")
+
+        if self.options.report_timings:
+            debug("Shared %d duplicate images with %d unique images" % (len(duplicates), len(originals)))
+
+    def pack_atlas(self, images: list[ExportImage], images_dir: str, output_dir: str, atlas_name: str):
+        """
+        Pack the rendered images into power-of-two pages with the transparent edges trimmed
+        and write a Spine atlas file, "<atlas_name>.atlas", with the pages next to it.
+        The regions are named after the image paths, the same way Spine finds the attachment images.
+        """
+        max_size = self.options.atlas_max_size
+        padding = max(0, self.options.atlas_padding)
+
+        # Objects with the same name write the same image file, the atlas only needs it once.
+        regions: dict[str, AtlasRegion] = {}
+        for image in images:
+            name = os.path.relpath(image.image_file, images_dir)[:-4].replace("\\", "/")
+            if name in regions or not os.path.isfile(image.image_file):
+                continue
+            with Image.open(image.image_file) as png:
+                trim = png.convert("RGBA").getchannel("A").getbbox()
+                orig = png.size
+            if trim is None:
+                # A fully transparent image still needs a region.
+                trim = (0, 0, 1, 1)
+            left, top, right, bottom = trim
+            regions[name] = AtlasRegion(name, image.image_file, (left, top, right - left, bottom - top), orig)
+
+        # Place the largest images first, into the first page with enough space.
+        # The padding is added to the right and bottom of each image, so the bin is larger by the padding.
+        packers: list[MaxRectsPacker] = []
+        for region in sorted(regions.values(), key=lambda r: (max(r.trim[2:]), r.trim[2] * r.trim[3]), reverse=True):
+            width, height = region.trim[2:]
+            if width > max_size or height > max_size:
+                raise AbortExtension("The image \"%s\" (%dx%d) is larger than the atlas page size %d"
+                                     % (region.name, width, height, max_size))
+            position = None
+            for page, packer in enumerate(packers):
+                position = packer.insert(width + padding, height + padding)
+                if position is not None:
+                    region.page = page
+                    break
+            if position is None:
+                packers.append(MaxRectsPacker(max_size + padding, max_size + padding))
+                region.page = len(packers) - 1
+                position = packers[-1].insert(width + padding, height + padding)
+            region.x, region.y = position
+
+        lines = []
+        for page in range(len(packers)):
+            page_regions = [region for region in regions.values() if region.page == page]
+            used_width = max(region.x + region.trim[2] for region in page_regions)
+            used_height = max(region.y + region.trim[3] for region in page_regions)
+            page_width = 1 << (used_width - 1).bit_length()
+            page_height = 1 << (used_height - 1).bit_length()
+
+            page_file = "%s%s.png" % (atlas_name, page + 1 if page > 0 else "")
+            page_image = Image.new("RGBA", (page_width, page_height), (0, 0, 0, 0))
+            for region in page_regions:
+                left, top, width, height = region.trim
+                with Image.open(region.image_file) as png:
+                    page_image.paste(png.convert("RGBA").crop((left, top, left + width, top + height)), (region.x, region.y))
+            page_image.save(os.path.join(output_dir, page_file))
+
+            lines += [
+                "",
+                page_file,
+                "size: %d,%d" % (page_width, page_height),
+                "format: RGBA8888",
+                "filter: Linear,Linear",
+                "repeat: none",
+            ]
+            for region in page_regions:
+                left, top, width, height = region.trim
+                lines += [
+                    region.name,
+                    "  rotate: false",
+                    "  xy: %d, %d" % (region.x, region.y),
+                    "  size: %d, %d" % (width, height),
+                    "  orig: %d, %d" % region.orig,
+                    # The offset is from the bottom left corner of the original image.
+                    "  offset: %d, %d" % (left, region.orig[1] - top - height),
+                    "  index: -1",
+                ]
+
+        with open(os.path.join(output_dir, "%s.atlas" % atlas_name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        if self.options.report_timings:
+            debug("Packed %d images into %d atlas pages" % (len(regions), len(packers)))
+
+    def get_skeleton_name(self) -> str:
+        # If user hasn't provided the skeleton name, use the document name instead.
+        skel_name = self.options.skel_name
+        if not skel_name or skel_name.isspace():
+            skel_name = self.get_document_name()
+        return skel_name
+
     def get_document_name(self) -> str:
         doc_root = self.svg
         doc_name = doc_root.xpath("//@sodipodi:docname", namespaces=inkex.NSS)
@@ -250,21 +1042,33 @@ class SpineExporter(inkex.EffectExtension):
         y = (global_height - top - bottom) / 2
         return x, y, width, height
 
-    def register_image_attachment(self, skel_struct, slot_name, attach_name, image_path, bbox):
+    @staticmethod
+    def index_skeleton(skel_struct) -> dict[str, dict[str, dict]]:
+        """
+        Index the bones, slots and skins of the Skeleton structure by name.
+        The index must be updated together with the lists.
+        """
+        return {
+            key: {obj["name"]: obj for obj in skel_struct[key]}
+            for key in ("bones", "slots", "skins")
+        }
+
+    def register_image_attachment(self, skel_struct, skel_index, slot_name, attach_name, image_path, bbox):
         """
         Add image attachment to the default skin and place it under the specified slot.
         """
         x, y, width, height = self.coords_to_spine(*bbox)
 
         # Find existing or create a new slot.
-        slot = self.find_named_elem(skel_struct["slots"], slot_name)
+        slot = skel_index["slots"].get(slot_name)
         if not slot:
-            slot = slot = {
+            slot = {
                 "name": slot_name,
                 "attachment": attach_name,
                 "bone": "root",
             }
             skel_struct["slots"].append(slot)
+            skel_index["slots"][slot_name] = slot
 
         # Compose attachment data.
         attach_props = {
@@ -277,7 +1081,7 @@ class SpineExporter(inkex.EffectExtension):
             attach_props["path"] = image_path
 
         # Insert the attachment under the default skin.
-        skin_attachments = skel_struct["skins"][0]["attachments"]
+        skin_attachments = skel_index["skins"]["default"]["attachments"]
         skin_slot_record = None
         if slot_name in skin_attachments:
             skin_slot_record = skin_attachments[slot_name]
@@ -287,51 +1091,175 @@ class SpineExporter(inkex.EffectExtension):
         skin_slot_record[attach_name] = attach_props
 
     @staticmethod
-    def is_hidden(node: BaseElement) -> bool:
-        style = inkex.Style.parse_str(node.attrib.get("style", ""))
-        return style.get("display") == "none"
+    def is_hidden(node: BaseElement, hidden_classes: set[str] = frozenset(), hidden_ids: set[str] = frozenset()) -> bool:
+        """
+        Check the "display" property of the node, from the style attribute, the stylesheet classes and ids
+        (see get_hidden_selectors()) or the presentation attribute, in the order of the CSS precedence.
+        """
+        displays = STYLE_DISPLAY.findall(node.attrib.get("style", ""))
+        if displays:
+            return displays[-1].split("!")[0].strip() == "none"
+        if node.get("id") in hidden_ids:
+            return True
+        if hidden_classes and any(name in hidden_classes for name in node.get("class", "").split()):
+            return True
+        return node.get("display", "").strip() == "none"
 
-    @staticmethod
-    def delete_invisible_children(node: BaseElement):
-        children = node.getchildren().copy()
-        for child_node in children:
-            if SpineExporter.is_hidden(child_node):
-                # debug("Invisible node removed: " + str(node.get_id()))
-                node.remove(child_node)
-            else:
-                SpineExporter.delete_invisible_children(child_node)
+    def get_hidden_selectors(self) -> tuple[set[str], set[str]]:
+        """
+        Collect the classes and ids the document stylesheets hide with "display: none".
+        Only simple ".class" and "#id" selectors are supported.
+        """
+        hidden_classes = set()
+        hidden_ids = set()
+        for style in self.svg.xpath("//svg:style", namespaces=inkex.NSS):
+            for selectors, declarations in CSS_RULE.findall(CSS_COMMENT.sub("", style.text or "")):
+                displays = STYLE_DISPLAY.findall(declarations.strip())
+                if not displays or displays[-1].split("!")[0].strip() != "none":
+                    continue
+                for selector in selectors.split(","):
+                    match = CSS_SIMPLE_SELECTOR.match(selector.strip())
+                    if match:
+                        (hidden_classes if match.group(1) == "." else hidden_ids).add(match.group(2))
+        return hidden_classes, hidden_ids
+
+    def delete_invisible_children(self, node: BaseElement):
+        """
+        Remove the hidden descendants of the node in a single pass, without descending into the removed subtrees.
+        """
+        hidden_classes, hidden_ids = self.get_hidden_selectors()
+        pending = [node]
+        while pending:
+            parent = pending.pop()
+            hidden = []
+            for child_node in parent:
+                # Skip comments and processing instructions.
+                if not isinstance(child_node.tag, str):
+                    continue
+                if self.is_hidden(child_node, hidden_classes, hidden_ids):
+                    hidden.append(child_node)
+                else:
+                    pending.append(child_node)
+            for child_node in hidden:
+                # debug("Invisible node removed: " + str(child_node.get_id()))
+                parent.remove(child_node)
 
-    # @staticmethod
     def get_bounding_box(self, node: BaseElement) -> tuple[float, float, float, float] | None:
-        node_id = node.get_id()
+        bbox_mode = self.options.bbox_mode
+        if bbox_mode not in (self.bbox_mode_inkscape, self.bbox_mode_hybrid, self.bbox_mode_verify):
+            raise NotImplementedError("Unexpected bounding box mode: " + bbox_mode)
+
+        bbox = None
+        if bbox_mode != self.bbox_mode_inkscape and self.has_geometric_bbox(node):
+            bbox = self.compute_bounding_box(node)
+
+        if bbox is not None and bbox_mode == self.bbox_mode_hybrid:
+            self.bbox_counts["python"] += 1
+            return bbox
+
+        query_bbox = self.query_bounding_box(node)
+        self.bbox_counts["inkscape"] += 1
+        if bbox is not None and query_bbox is not None:
+            self.bbox_counts["python"] += 1
+            tolerance = self.options.bbox_tolerance
+            if any(abs(a - b) > tolerance for a, b in zip(bbox, query_bbox)):
+                self.bbox_counts["mismatched"] += 1
+                debug("Bounding box mismatch for \"%s\": computed %s, Inkscape %s"
+                      % (node.get_id(), self.format_bbox(bbox), self.format_bbox(query_bbox)))
+        return query_bbox
 
-        def q(arg: str) -> float:
-            # Ask Inkscape for the bbox of this id in page coordinates (px)
+    def query_bounding_box(self, node: BaseElement) -> tuple[float, float, float, float] | None:
+        if self.bbox_cache is None:
+            self.bbox_cache = self.query_all_bounding_boxes()
+        return self.bbox_cache.get(node.get_id())
+
+    def has_geometric_bbox(self, node: BaseElement) -> bool:
+        """
+        Check if the visual bounding box Inkscape reports for the node equals its geometric bounding box.
+        That requires plain shapes, without strokes (also inherited ones), markers, filters, clips or masks.
+        """
+        # Stylesheet rules (by type, id, class or "*") may add strokes, markers or filters to any element.
+        if self.has_stylesheets is None:
+            self.has_stylesheets = len(self.svg.xpath("//svg:style", namespaces=inkex.NSS)) > 0
+        if self.has_stylesheets:
+            return False
+
+        def is_plain(elem: BaseElement, check_shape: bool) -> bool:
+            if check_shape and elem.tag not in BBOX_SHAPE_TAGS:
+                return False
+            style = elem.attrib.get("style", "")
+            for prop in BBOX_VISUAL_PROPERTIES:
+                if prop in style or elem.get(prop):
+                    return False
+            stroke = self.get_style_value(style, "stroke") or elem.get("stroke")
+            return stroke is None or stroke.strip() == "none"
+
+        for ancestor in node.iterancestors():
+            if not is_plain(ancestor, False):
+                return False
+        for elem in node.iter():
+            if not isinstance(elem.tag, str) or elem.tag in BBOX_IGNORED_TAGS:
+                continue
+            if not is_plain(elem, True):
+                return False
+        return True
+
+    @staticmethod
+    def get_style_value(style: str, name: str) -> str | None:
+        value = None
+        for declaration in style.split(";"):
+            key, _, declared = declaration.partition(":")
+            if key.strip() == name:
+                value = declared.strip()
+        return value
+
+    def compute_bounding_box(self, node: BaseElement) -> tuple[float, float, float, float] | None:
+        """
+        Compute the node's bounding box in page coordinates (px), the same way Inkscape reports it.
+        """
+        parent = node.getparent()
+        transform = parent.composed_transform() if parent is not None else inkex.Transform()
+        box = node.bounding_box(transform)
+        if box is None:
+            return None
+
+        # Convert the user units to px relative to the page.
+        scale = self.svg.scale
+        view_x, view_y = self.svg.get_viewbox()[:2]
+        return (box.left - view_x) * scale, (box.top - view_y) * scale, box.width * scale, box.height * scale
+
+    @staticmethod
+    def format_bbox(bbox: tuple[float, float, float, float]) -> str:
+        return "(%.2f, %.2f, %.2f, %.2f)" % bbox
+
+    def query_all_bounding_boxes(self) -> dict[str, tuple[float, float, float, float]]:
+        """
+        Ask Inkscape for the bbox of every object in the document in page coordinates (px).
+        A single "query-all" call loads the document once, instead of four times per object.
+        """
+        if self.inkscape_shell is not None and self.inkscape_shell.accepts(self.options.input_file):
+            self.profiler.count_inkscape_call(shell=True)
+            out = self.inkscape_shell.run("file-open:%s;query-all;file-close" % self.options.input_file)
+        else:
+            self.profiler.count_inkscape_call()
             out = inkscape(
                 self.options.input_file,
                 **{
-                    "query-id": node_id,
-                    arg: None,
+                    "query-all": None,
                 }
             )
-            return float(str(out).strip())
 
-        x = q("query-x")
-        y = q("query-y")
-        width = q("query-width")
-        height = q("query-height")
-        return x, y, width, height
-
-    @staticmethod
-    def find_named_elem(array: list, name):
-        """
-        Find an element with a matching "name" property in the array.
-        This is suitable for searching for a specific bone or slot in the Skeleton structure.
-        """
-        for obj in array:
-            if obj["name"] == name:
-                return obj
-        return None
+        bboxes = {}
+        for line in str(out).splitlines():
+            # Each line is "id,x,y,width,height". Split from the right, as the id may contain commas.
+            fields = line.strip().rsplit(",", 4)
+            if len(fields) != 5:
+                continue
+            try:
+                bboxes[fields[0]] = tuple(float(value) for value in fields[1:])
+            except ValueError:
+                continue
+        return bboxes
 
     @staticmethod
     def center_skel_content(skel_struct):
@@ -369,5 +1297,140 @@ class SpineExporter(inkex.EffectExtension):
                 attach["y"] = attach.get("y", 0.0) - bb_center_y
 
 
+def find_documents(inputs: list[str]) -> list[tuple[str, str]]:
+    """
+    Find the SVG files of the inputs (files, directories searched recursively, or glob patterns).
+    Return the document paths with their output sub-directory names, which are unique.
+    """
+    documents = []
+    seen = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            paths = sorted(glob.glob(os.path.join(pattern, "**", "*.svg"), recursive=True))
+            names = [os.path.splitext(os.path.relpath(path, pattern))[0] for path in paths]
+        else:
+            paths = sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.isfile(pattern) else [])
+            names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        for path, name in zip(paths, names):
+            path = os.path.abspath(path)
+            if path in seen:
+                continue
+            seen.add(path)
+            documents.append((path, name))
+
+    used = set()
+    unique = []
+    for path, name in documents:
+        unique_name = name
+        index = 2
+        while unique_name in used:
+            unique_name = "%s_%d" % (name, index)
+            index += 1
+        used.add(unique_name)
+        unique.append((path, unique_name))
+    return unique
+
+
+def run_batch(argv: list[str]) -> int:
+    """
+    Export many documents from the command line, without Inkscape's user interface:
+    objects_to_spine.py batch [options] inputs... [-- exporter options]
+    Each thread exports one document at a time and keeps its own Inkscape shell for all of its documents.
+    """
+    extension_args = []
+    if "--" in argv:
+        extension_args = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser(
+        prog="objects_to_spine.py batch",
+        description="Export SVG documents to Spine. The options after \"--\" are passed to the exporter, "
+                    "e.g. \"-- --compact-names true --atlas true\".",
+    )
+    parser.add_argument("inputs", nargs="+", help="SVG files, directories or glob patterns")
+    parser.add_argument("--outdir", required=True,
+                        help="Output directory, each document is exported to a sub-directory named after it")
+    parser.add_argument("--parallel", type=int, default=1,
+                        help="Number of documents exported at the same time (0 = one per CPU)")
+    parser.add_argument("--no-shell", action="store_true",
+                        help="Start Inkscape for each call instead of reusing an Inkscape shell")
+    parser.add_argument("--report", help="Write a JSON report of the timings and failures to this file")
+    options = parser.parse_args(argv)
+
+    documents = find_documents(options.inputs)
+    if not documents:
+        print("No SVG documents found", file=sys.stderr)
+        return 1
+
+    # Export the visible layers to JSON by default, the exporter options may override it.
+    default_args = ["--export-mode", SpineExporter.mode_visible_layers, "--json", "true"]
+
+    local = threading.local()
+    shells = []
+    shells_lock = threading.Lock()
+
+    def export_document(document: tuple[str, str]) -> dict:
+        path, name = document
+        output_dir = os.path.join(os.path.abspath(options.outdir), name)
+        result = {"document": path, "output": output_dir, "status": "ok", "error": None, "images": 0}
+        start = time.time()
+        exporter = SpineExporter()
+        if not options.no_shell:
+            if not hasattr(local, "shell"):
+                local.shell = InkscapeShell()
+                with shells_lock:
+                    shells.append(local.shell)
+            exporter.inkscape_shell = local.shell
+        try:
+            exporter.parse_arguments(default_args + extension_args + ["--outdir", output_dir, path])
+            exporter.load_raw()
+            exporter.effect()
+            result["images"] = len(exporter.images)
+        except (Exception, SystemExit) as error:
+            result["status"] = "failed"
+            result["error"] = str(error) or type(error).__name__
+        finally:
+            exporter.clean_up()
+        result["seconds"] = time.time() - start
+        result["render_seconds"] = sum(exporter.render_timings.values())
+        print("%s %s (%d images, %.2f s)%s" % (
+            "Exported" if result["status"] == "ok" else "FAILED", path, result["images"], result["seconds"],
+            ": " + result["error"] if result["error"] else ""), file=sys.stderr)
+        return result
+
+    start = time.time()
+    workers = options.parallel if options.parallel > 0 else os.cpu_count() or 1
+    try:
+        with ThreadPoolExecutor(max_workers=min(workers, len(documents))) as executor:
+            results = list(executor.map(export_document, documents))
+    finally:
+        for shell in shells:
+            shell.close()
+    total_seconds = time.time() - start
+
+    failed = [result for result in results if result["status"] != "ok"]
+    print("Exported %d of %d documents in %.2f s, %d images, %d failed" % (
+        len(results) - len(failed), len(results), total_seconds, sum(result["images"] for result in results),
+        len(failed)), file=sys.stderr)
+    for result in failed:
+        print("  %s: %s" % (result["document"], result["error"]), file=sys.stderr)
+
+    if options.report:
+        report = {
+            "documents": len(results),
+            "failed": len(failed),
+            "seconds": total_seconds,
+            "parallel": workers,
+            "shell": not options.no_shell,
+            "results": results,
+        }
+        with open(options.report, "w") as f:
+            json.dump(report, f, indent=1)
+
+    return 1 if failed else 0
+
+
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["batch"]:
+        sys.exit(run_batch(sys.argv[2:]))
     SpineExporter().run()